@@ -222,6 +222,24 @@ class TestGoodList(unittest.TestCase):
         rkiv = S3Archive(self.conn, TEST_BUCKET_NAME, 'test_object')
         self.assertEqual(len(rkiv.list(options={'max-keys':2, 'prefix':'test_object'})), 3)
     
+    def testListColumns(self):
+        """ should list names, sizes and last modified times as columns """
+        try: util.force_delete_bucket(self.conn, TEST_BUCKET_NAME)
+        except S3ResponseError: pass
+        
+        rkiv = S3Archive(self.conn, TEST_BUCKET_NAME, 'test_object')
+        
+        for i in range(3):
+            io = rkiv.new_io()
+            io.write('a' * (i + 1))
+            io.close()
+            time.sleep(1)
+        
+        columns = rkiv.list_columns(options={'max-keys':2, 'prefix':'test_object.'})
+        self.assertEqual(columns.keys, rkiv.list())
+        self.assertEqual(list(columns.sizes), [1, 2, 3])
+        self.assert_(abs(columns.last_modified[-1] - time.time()) < 3600)
+    
     def testObjectConflict(self):
         """ functions on an archived object shouldn't conflict with a non archived object """
         try: util.force_delete_bucket(self.conn, TEST_BUCKET_NAME)
@@ -296,6 +314,16 @@ class TestScratch(unittest.TestCase):
         rkiv.scratch()
         self.assertEqual(len(rkiv.list()), 2)
      
+    def testStaleFqons(self):
+        """ stale instances are the oldest ones past the copy count and older than days """
+        now = datetime(2010, 1, 10, 12)
+        fqons = ['test_object.201001%02d.201001%02d000000' % (day, day) for day in range(1, 11)]
+        self.assertEqual(stale_fqons(fqons, 0, 4, now), fqons[:6])
+        self.assertEqual(stale_fqons(fqons, 7, 4, now), fqons[:2])
+        self.assertEqual(stale_fqons(fqons, 7, 9, now), fqons[:1])
+        self.assertEqual(stale_fqons(fqons, -1, 4, now), [])
+        self.assertEqual(stale_fqons(fqons, 0, 10, now), [])
+     
     def testDaysAndCopies(self):
         """ should leave 3 copies the first time, has to meet both retention conditions. leave one copy the 2nd time. """
         try: util.force_delete_bucket(self.conn, TEST_BUCKET_NAME)
@@ -317,6 +345,30 @@ class TestScratch(unittest.TestCase):
         rkiv.scratch()
         self.assertEqual(len(rkiv.list()), 1)   
     
+    def testPropsCache(self):
+        """ other archive objects should share the props, revalidated once they are stale """
+        try: util.force_delete_bucket(self.conn, TEST_BUCKET_NAME)
+        except S3ResponseError: pass
+
+        rkiv = S3Archive(self.conn, TEST_BUCKET_NAME, 'test_object')
+        rkiv.set_retention(days=3, copies=7)
+
+        props_cache.invalidate()
+        rkiv = S3Archive(self.conn, TEST_BUCKET_NAME, 'test_object')
+        rkiv.load_retention()
+        self.assertEqual((rkiv.days, rkiv.copies), (3, 7))
+        props, etag, is_fresh = props_cache.get(self.conn.host, TEST_BUCKET_NAME, 'test_object')
+        self.assert_(etag and is_fresh)
+
+        props_cache.ttl, ttl = 0, props_cache.ttl
+        try:
+            rkiv = S3Archive(self.conn, TEST_BUCKET_NAME, 'test_object')
+            rkiv.load_retention()
+            self.assertEqual((rkiv.days, rkiv.copies), (3, 7))
+            self.assertEqual(props_cache.get(self.conn.host, TEST_BUCKET_NAME, 'test_object')[1], etag)
+        finally:
+            props_cache.ttl = ttl
+
         
     def tearDown(self):
         try: util.force_delete_bucket(self.conn, TEST_BUCKET_NAME)
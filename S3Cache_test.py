@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pys3 import *
+from pys3.lib import S3
+
+#In a file called amazon_credentials.py you must supply 
+#values for two variables: AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY
+from amazon_credentials import *
+
+TEST_BUCKET_NAME = AWS_ACCESS_KEY_ID + '_test_bucket'
+
+class TestObjectCache(unittest.TestCase):
+    def setUp(self):
+        self.contents = 'cached object test'
+        self.conn = S3.AWSAuthConnection(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+        self.directory = tempfile.mkdtemp()
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', {'key': 'value'})
+        io.write(self.contents)
+        io.close()
+        
+    def testMemory(self):
+        """ an unchanged object should be read from memory """
+        cache = S3ObjectCache()
+        for i in range(2):
+            io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', cache=cache)
+            self.assertEqual(io.read(), self.contents)
+            self.assertEqual(io.meta, {'key': 'value'})
+            io.meta['key'] = 'changed' #not written, so other readers shouldn't see it
+        self.assertEqual(cache.memory_len, len(self.contents))
+        
+    def testDisk(self):
+        """ another cache sharing the directory should read the object from disk """
+        S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', cache=S3ObjectCache(self.directory)).read()
+        
+        cache = S3ObjectCache(self.directory, max_memory=0)
+        self.assert_(cache._lookup(TEST_BUCKET_NAME, 'test_object'))
+        self.assertEqual(S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', cache=cache).read(), self.contents)
+        
+    def testChanged(self):
+        """ a changed object should be downloaded again """
+        cache = S3ObjectCache(self.directory)
+        S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', cache=cache).read()
+        
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object')
+        io.write('changed')
+        io.close()
+        
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', cache=cache)
+        self.assertEqual(io.read(), 'changed')
+        
+    def testEviction(self):
+        """ the disk cache should stay within max_disk bytes """
+        cache = S3ObjectCache(self.directory, max_disk=1024)
+        for i in range(10):
+            io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object%d' % i)
+            io.write('x' * 200)
+            io.close()
+            S3IO(self.conn, TEST_BUCKET_NAME, 'test_object%d' % i, cache=cache).read()
+        
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+        self.assert_(sum([os.path.getsize(path) for path in paths]) <= 1024)
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        force_delete_bucket(self.conn, TEST_BUCKET_NAME)
+        
+
+if __name__ == '__main__':
+    if not AWS_ACCESS_KEY_ID or not AWS_SECRET_ACCESS_KEY:
+        raise Exception("Must supply Amazon credentials")
+    
+    unittest.main()
@@ -280,7 +280,24 @@ class TestGoodRead( unittest.TestCase ):
         self.assertEquals(self.contents[:1], io.read())
         io.close()
         self.setUp() #reset the base state for other tests
-        
+
+    def testStat(self):
+        """ stat should describe the stored object without reading it """
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_meta', {'color': 'blue'})
+        io.write(self.contents)
+        io.close()
+
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_meta')
+        stat = io.stat()
+        self.assertEquals(stat.size, len(self.contents))
+        self.assertEquals(stat.metadata, {'color': 'blue'})
+        self.assert_(stat.etag and stat.last_modified)
+        self.assert_(io.stat() is stat) #from the head cache
+
+        self.assertEquals(io.read(), self.contents)
+        self.assertEquals(io.meta, {'color': 'blue'})
+        self.assertEquals(S3IO(self.conn, TEST_BUCKET_NAME, 'no_such_object').stat(), None)
+
     def tearDown(self):
         force_delete_bucket(self.conn, TEST_BUCKET_NAME)
     
@@ -311,6 +328,199 @@ class TestNatural(unittest.TestCase):
     def tearDown(self):
         force_delete_bucket(self.conn, TEST_BUCKET_NAME)
         
+
+class TestMultipart(unittest.TestCase):
+    def setUp(self):
+        self.conn = S3.AWSAuthConnection(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+        self.part = 'x' * S3.MIN_PART_SIZE
+
+    def testPartsShippedWhileWriting(self):
+        """ Full parts are uploaded before the object is closed """
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', multipart=True, part_size=S3.MIN_PART_SIZE)
+        io.write(self.part)
+        io.write(self.part)
+        self.assertEqual(io.shipped_len, 2 * S3.MIN_PART_SIZE)
+        io.write('tail')
+        io.close()
+
+        r = self.conn.get(TEST_BUCKET_NAME, 'test_object')
+        self.assertEqual(r.object.data, self.part + self.part + 'tail')
+
+    def testOverwriteShippedPart(self):
+        """ Overwriting data that was already shipped re-uploads the whole buffer """
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', multipart=True, part_size=S3.MIN_PART_SIZE)
+        io.write(self.part + 'tail')
+        io.seek(0)
+        io.write('y')
+        io.close()
+
+        r = self.conn.get(TEST_BUCKET_NAME, 'test_object')
+        self.assertEqual(r.object.data, 'y' + self.part[1:] + 'tail')
+
+    def testSmallObject(self):
+        """ Objects smaller than one part are sent with a single PUT """
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', multipart=True)
+        io.write('abracadabra')
+        io.close()
+        self.assertEqual(io.upload, None)
+
+        r = self.conn.get(TEST_BUCKET_NAME, 'test_object')
+        self.assertEqual(r.object.data, 'abracadabra')
+
+    def tearDown(self):
+        try:
+            force_delete_bucket(self.conn, TEST_BUCKET_NAME)
+        except S3ResponseError:
+            pass
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.conn = S3.AWSAuthConnection(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+
+    def testSpill(self):
+        """ The buffer moves to a temporary file past spool_size and is uploaded from it """
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', spool_size=10)
+        io.write('abracadabra')
+        self.assertNotEqual(io.file, None)
+        io.seek(0)
+        io.write('A')
+        io.seek(0)
+        self.assertEqual(io.readline(), 'Abracadabra')
+        io.close()
+
+        r = self.conn.get(TEST_BUCKET_NAME, 'test_object')
+        self.assertEqual(r.object.data, 'Abracadabra')
+
+    def testSpillMultipart(self):
+        """ Parts of a spilled buffer are uploaded from the temporary file """
+        part = 'x' * S3.MIN_PART_SIZE
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object', multipart=True,
+                  part_size=S3.MIN_PART_SIZE, spool_size=1024)
+        io.write(part + 'tail')
+        io.seek(0)
+        io.write('y')
+        io.close()
+
+        r = self.conn.get(TEST_BUCKET_NAME, 'test_object')
+        self.assertEqual(r.object.data, 'y' + part[1:] + 'tail')
+
+    def tearDown(self):
+        try:
+            force_delete_bucket(self.conn, TEST_BUCKET_NAME)
+        except S3ResponseError:
+            pass
+
+class TestWriteIO(unittest.TestCase):
+    def setUp(self):
+        self.conn = S3.AWSAuthConnection(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+
+    def testStream(self):
+        """ Chunks are shipped as they fill and only the unfilled chunk is buffered """
+        part = 'x' * S3.MIN_PART_SIZE
+        io = S3WriteIO(self.conn, TEST_BUCKET_NAME, 'test_object', chunk_size=S3.MIN_PART_SIZE)
+        io.write(part)
+        io.write(part)
+        io.write('tail')
+        self.assertEqual(io.chunk_len, 4)
+        io.close()
+
+        r = self.conn.get(TEST_BUCKET_NAME, 'test_object')
+        self.assertEqual(r.object.data, part + part + 'tail')
+
+    def testSmallObject(self):
+        """ A stream shorter than one chunk is sent with a single PUT """
+        io = S3WriteIO(self.conn, TEST_BUCKET_NAME, 'test_object')
+        io.write('abracadabra')
+        io.close()
+
+        r = self.conn.get(TEST_BUCKET_NAME, 'test_object')
+        self.assertEqual(r.object.data, 'abracadabra')
+
+    def testWriteOnly(self):
+        """ Reading and seeking are not supported """
+        io = S3WriteIO(self.conn, TEST_BUCKET_NAME, 'test_object')
+        self.assertRaises(S3IOError, io.read)
+        self.assertRaises(S3IOError, io.seek, 0)
+        io.abort()
+
+    def tearDown(self):
+        try:
+            force_delete_bucket(self.conn, TEST_BUCKET_NAME)
+        except S3ResponseError:
+            pass
+
+class TestReadIO(unittest.TestCase):
+    def setUp(self):
+        self.contents = ''.join(['line %d\n' % i for i in range(1000)])
+        self.conn = S3.AWSAuthConnection(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+        io = S3IO(self.conn, TEST_BUCKET_NAME, 'test_object')
+        io.write(self.contents)
+        io.close()
+
+    def testReadPortion(self):
+        """ Only the blocks that hold the portion are fetched """
+        io = S3ReadIO(self.conn, TEST_BUCKET_NAME, 'test_object', block_size=100)
+        self.assertEqual(io.read(5), self.contents[:5])
+        self.assertEqual(io.blocks.keys(), [0])
+
+    def testSeekFromEnd(self):
+        """ Should be able to read the tail of the object """
+        io = S3ReadIO(self.conn, TEST_BUCKET_NAME, 'test_object', block_size=100)
+        io.seek(-250, 2)
+        self.assertEqual(io.read(), self.contents[-250:])
+
+    def testReadAll(self):
+        """ Sequential reads see the whole object """
+        io = S3ReadIO(self.conn, TEST_BUCKET_NAME, 'test_object', block_size=100, cache_blocks=4)
+        self.assertEqual(io.read(), self.contents)
+        self.assertEqual(len(io.blocks), 4)
+        io.seek(0)
+        self.assertEqual(list(io), self.contents.splitlines(True))
+
+    def testSeekPastEnd(self):
+        """ Reading past the end returns nothing and leaves the object readable """
+        io = S3ReadIO(self.conn, TEST_BUCKET_NAME, 'test_object', block_size=100)
+        io.seek(len(self.contents) + 1000)
+        self.assertEqual(io.read(), '')
+        self.assertEqual(io.size, len(self.contents))
+        io.seek(0)
+        self.assertEqual(io.read(), self.contents)
+
+    def testMissingObject(self):
+        """ A missing object reads as empty, like S3IO """
+        io = S3ReadIO(self.conn, TEST_BUCKET_NAME, 'missing_object')
+        self.assertEqual(io.read(), '')
+
+    def tearDown(self):
+        force_delete_bucket(self.conn, TEST_BUCKET_NAME)
+
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        self.conn = S3.AsyncAWSAuthConnection(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+
+    def testWriteRead(self):
+        """ Operations return futures and run in the order they were called """
+        io = AsyncS3IO(self.conn, TEST_BUCKET_NAME, 'test_object')
+        io.write('aqua')
+        io.write('teen')
+        io.close().result()
+
+        io = AsyncS3IO(self.conn, TEST_BUCKET_NAME, 'test_object')
+        self.assertEqual(io.read().result(), 'aquateen')
+        io.close().result()
+
+    def testErrorInFuture(self):
+        """ Errors are raised by the future's result() """
+        io = AsyncS3IO(self.conn, TEST_BUCKET_NAME, 'test_object')
+        io.write('')
+        self.assertRaises(S3IOError, io.flush().result)
+
+    def tearDown(self):
+        try:
+            force_delete_bucket(self.conn.conn, TEST_BUCKET_NAME)
+        except S3ResponseError:
+            pass
+        self.conn.close()
                 
 if __name__ == '__main__':
     if not AWS_ACCESS_KEY_ID or not AWS_SECRET_ACCESS_KEY:
@@ -0,0 +1,55 @@
+import unittest
+import time
+import logging
+from pys3 import *
+from pys3.lib import S3
+logging.root.setLevel(logging.DEBUG)
+
+#In a file called amazon_credentials.py you must supply
+#values for two variables: AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY
+from amazon_credentials import *
+
+TEST_BUCKET_NAME = AWS_ACCESS_KEY_ID + '_test_bucket'
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.conn = S3.AWSAuthConnection(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+        for object_prefix, copies in [('testSweepA', 2), ('testSweepB', 5), ('testSweepC', None)]:
+            rkiv = S3Archive(self.conn, TEST_BUCKET_NAME, object_prefix, auto_scratch=False)
+            if copies:
+                rkiv.set_retention(days=0, copies=copies)
+            for day in range(1, 5):
+                io = rkiv.new_io(logical_date=time.strptime('201001%02d' % day, '%Y%m%d'))
+                io.write(object_prefix)
+                io.close()
+
+    def testDiscover(self):
+        """ should sweep every archive with props, and skip the rest """
+        reports = S3Retention(self.conn, TEST_BUCKET_NAME).sweep()
+        self.assertEqual([report.object_prefix for report in reports], ['testSweepA', 'testSweepB', 'testSweepC'])
+
+        a, b, c = reports
+        self.assertEqual((a.instances, a.stale, a.deleted, a.errors), (4, 2, 2, []))
+        self.assertEqual((b.instances, b.stale, b.deleted), (4, 0, 0))
+        self.assert_(c.skipped)
+
+        self.assertEqual(len(S3Archive(self.conn, TEST_BUCKET_NAME, 'testSweepA', auto_scratch=False).list()), 2)
+        self.assertEqual(len(S3Archive(self.conn, TEST_BUCKET_NAME, 'testSweepC', auto_scratch=False).list()), 4)
+
+    def testObjectPrefixes(self):
+        """ named archives without props get the default retention, like scratch() """
+        reports = S3Retention(self.conn, TEST_BUCKET_NAME, ['testSweepC']).sweep()
+        self.assertEqual(len(reports), 1)
+        self.assertEqual((reports[0].days, reports[0].copies), (400, 10))
+        self.assertEqual(reports[0].deleted, 0)
+
+    def tearDown(self):
+        try: util.force_delete_bucket(self.conn, TEST_BUCKET_NAME)
+        except S3ResponseError: pass
+
+
+if __name__ == '__main__':
+    if not AWS_ACCESS_KEY_ID or not AWS_SECRET_ACCESS_KEY:
+        raise Exception("Must supply Amazon credentials")
+
+    unittest.main()
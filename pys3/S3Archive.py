@@ -1,22 +1,44 @@
 from StringIO import StringIO
+import bisect
 import exceptions
 import pickle
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 from lib import S3
 from S3Errors import *
 from S3IO import *
+from S3Props import *
 import util
 
 __all__ = [
        "S3ArchiveError",
        "S3ArchiveIO", "s3archiveio",
-       "S3Archive", "s3archive"
+       "S3Archive", "s3archive",
+       "stale_fqons",
+       "PropsCache", "props_cache"
 ]
 
 class S3ArchiveError(S3Error): pass
 
+def stale_fqons(fqons, days, copies, now=None):
+    """ the instances that scratch() frees, given fqons in the order list() 
+        returns them.  that order is by logical date, so the stale instances are
+        always the first ones, and finding them takes one comparison against a 
+        cutoff date instead of working out the age of every instance. """
+    
+    if copies < 0 or days < 0 or len(fqons) <= copies:
+        return []
+    
+    candidates = fqons[:len(fqons) - copies]
+    if days == 0:
+        return candidates
+    
+    #an instance is older than days once its logical date is on or before this one
+    cutoff = ((now or datetime.now()) - timedelta(days=days + 1)).strftime('%Y%m%d')
+    logical_dates = [fqon.rsplit('.', 2)[1] for fqon in candidates]
+    return candidates[:bisect.bisect_right(logical_dates, cutoff)]
+
 class S3ArchiveIO(S3IO):
     """ an version of a logical object """ 
     
@@ -53,7 +75,7 @@ s3archiveio = S3ArchiveIO
 class S3Archive:
     """ manage historical versions of an object, automatically handles retention """   
         
-    def __init__(self, conn, bucket_name, object_prefix):
+    def __init__(self, conn, bucket_name, object_prefix, auto_scratch=True):
 
         if object_prefix.count('.'):
             raise S3ArchiveError("object_prefix cannot contain any periods.")
@@ -64,6 +86,7 @@ class S3Archive:
         self.props = None
         self.days = None
         self.copies = None
+        self.auto_scratch = auto_scratch #scratch() when the archive is garbage collected
     
     def __str__(self):
         return '<S3Archive - %s.%s>' % (self.bucket_name, self.object_prefix)
@@ -72,9 +95,29 @@ class S3Archive:
         return __str__()
     
     def _get_props(self):
-        io = S3IO(self.conn, self.bucket_name, self.object_prefix+'.props')
-        props = pickle.load(io)
+        """ the props from the cache, revalidated or read with a single GET
+            when they are stale or missing.  raises EOFError if there are none """
+        cached = props_cache.get(self.conn.host, self.bucket_name, self.object_prefix)
+        if cached and cached[2]:
+            return cached[0]
+        
+        headers = {}
+        if cached and cached[1]:
+            headers['If-None-Match'] = cached[1]
+        
+        r = self.conn.get(self.bucket_name, self.object_prefix+'.props', headers)
+        if r.http_response.status == 304:
+            props_cache.put(self.conn.host, self.bucket_name, self.object_prefix, cached[0], cached[1])
+            return cached[0]
+        
+        if r.http_response.status == 404:
+            props_cache.invalidate(self.conn.host, self.bucket_name, self.object_prefix)
+            raise EOFError("%s.props doesn't exist" % self.object_prefix)
+        
+        util.check_http_response(r)
+        props = pickle.loads(r.object.data)
         logging.debug('contents of %s.props: %s' % (self.object_prefix, props))
+        props_cache.put(self.conn.host, self.bucket_name, self.object_prefix, props, r.http_response.getheader('ETag'))
         return props
 
     def set_retention(self, days=400, copies=10):
@@ -84,6 +127,26 @@ class S3Archive:
         io = S3IO(self.conn, self.bucket_name, self.object_prefix+'.props')
         pickle.dump(self.props, io)
         io.close()
+        props_cache.put(self.conn.host, self.bucket_name, self.object_prefix, self.props)
+    
+    def load_retention(self, set_default=True):
+        """ read days and copies from the props object, if they haven't been 
+            read already.  if there is no props object the default retention
+            is set, unless set_default is False, in which case False is returned """
+        
+        if not self.props:
+            try:
+                self.props = self._get_props()
+                self.days = self.props['days'] #if days is <= 0 then keep indefinatly
+                self.copies = self.props['copies'] #if copies is <= 0 then keep indefinatly 
+                
+            except EOFError:
+                #props file not set
+                if not set_default:
+                    return False
+                self.set_retention()
+        
+        return True
     
     def new_io(self, logical_date=None):
         """ get a new instance of this logical object """
@@ -125,8 +188,7 @@ class S3Archive:
             
         if physical_date:
             #try to find the most recent existing match
-            fqons = self.list()
-            for fqon in fqons:
+            for fqon in self.iterate():
                 if fqon[-14:] == physical_date:
                     return S3ArchiveIO(self, fqon=fqon)
             
@@ -147,32 +209,73 @@ class S3Archive:
             #return the most recent addition to the archive
             return S3ArchiveIO(self, fqon=self.list()[-1])
         
-    def list(self, options=None):
-        """ list all the instances of this logical object
+    def iterate(self, options=None):
+        """ yield the instances of this logical object one at a time, in order,
+            listing a page at a time instead of waiting for the whole listing.
             options is a list that is sent in the request to the webservice"""
             
         if not options:
             options = {'prefix': self.object_prefix+'.'}
         
-        is_truncated = True #on the first time, assume the response is truncated
-        fqons = []
+        logging.debug('listing the contents of \'%s\' with options \'%s\'' % (self.bucket_name, options))
+        entries = self.conn.iter_bucket(self.bucket_name, options.get('prefix'), 
+                                        marker=options.get('marker'), max_keys=options.get('max-keys'))
+        try:
+            for list_entry in entries:
+                if list_entry.key != self.object_prefix + '.props':
+                    yield list_entry.key
+        except S3.ListError, e:
+            if e.response.http_response.status == 404:
+                # bucket doesn't exist, there are no instances
+                return
+            raise S3ResponseError, e.response
+    
+    def _month_boundaries(self, marker, now=None):
+        """ the first instance name of every month after marker's, up to next 
+            month.  instances sort by logical date, so an archive too big for 
+            one page is listed a month at a time, in parallel, from the last 
+            instance on the first page. """
+        now = now or datetime.now()
+        logical_date = marker[len(self.object_prefix) + 1:]
+        try:
+            first = int(logical_date[:4]) * 12 + int(logical_date[4:6])
+        except ValueError:
+            first = 1970 * 12 #not an instance, start from the epoch
+        return ['%s.%04d%02d' % (self.object_prefix, month // 12, month % 12 + 1) 
+                for month in range(first, now.year * 12 + now.month + 1)]
+    
+    def list_columns(self, options=None, parallelism=S3.DEFAULT_LIST_PARALLELISM):
+        """ list all the instances of this logical object as an S3.ListColumns 
+            of their names, sizes and last modified times
+            options is a list that is sent in the request to the webservice"""
         
-        while is_truncated:
-            logging.debug('listing the contents of \'%s\' with options \'%s\'' % (self.bucket_name, options))
-            r = self.conn.list_bucket(self.bucket_name, options=options)
-            if r.http_response.status == 404:
-                # bucket doesn't exist, return empty list
-                return []
-            
-            util.check_http_response(r)
-            fqons.extend([list_entry.key for list_entry in r.entries])
-            is_truncated = r.is_truncated
-            if is_truncated:
-                options['marker'] = r.entries[-1].key 
-        
-        if fqons and fqons[-1] == self.object_prefix + '.props':
-            fqons.pop()
-            
+        if not options:
+            options = {'prefix': self.object_prefix+'.'}
+        
+        logging.debug('listing the contents of \'%s\' with options \'%s\'' % (self.bucket_name, options))
+        try:
+            columns = self.conn.list_bucket_columns(self.bucket_name, options.get('prefix'), 
+                                                    options.get('marker'), options.get('max-keys'),
+                                                    parallelism=parallelism, 
+                                                    boundaries=self._month_boundaries)
+        except S3.ListError, e:
+            if e.response.http_response.status == 404:
+                # bucket doesn't exist, there are no instances
+                return S3.ListColumns()
+            raise S3ResponseError, e.response
+        
+        if columns.keys and columns.keys[-1] == self.object_prefix + '.props':
+            columns.keys.pop()
+            columns.sizes.pop()
+            columns.last_modified.pop()
+        
+        return columns
+    
+    def list(self, options=None, parallelism=S3.DEFAULT_LIST_PARALLELISM):
+        """ list all the instances of this logical object
+            options is a list that is sent in the request to the webservice"""
+        
+        fqons = self.list_columns(options, parallelism).keys
         logging.debug(fqons)
         return fqons
     
@@ -182,40 +285,20 @@ class S3Archive:
                 -their logical age must be older than self.days 
                 -they contribute to a total instance count that is greater than self.copies """
         
-        if not self.props:
-            try:
-                self.props = self._get_props()
-                self.days = self.props['days'] #if days is <= 0 then keep indefinatly
-                self.copies = self.props['copies'] #if copies is <= 0 then keep indefinatly 
-                
-            except EOFError:
-                #props file not set
-                self.set_retention()
-        
+        self.load_retention()
         logging.info("starting scratch() days:%s, copies:%s" % (self.days, self.copies))
                     
         fqons = self.list()
         logging.debug('number of copies: %d' % (len(fqons)))
-        if self.copies >= 0 and len(fqons) > self.copies:
-            for fqon in fqons[:len(fqons)-self.copies]:
-                object_prefix, logical_date, physical_date = fqon.rsplit('.', 2)
-                age = (datetime.now() - datetime.strptime(logical_date, '%Y%m%d')).days
-                logging.debug('age: %d' % (age))
-                if self.days == 0:
-                    #delete object
-                    logging.info("deleting stale object:" + fqon)
-                    r = self.conn.delete(self.bucket_name, fqon)
-                    util.check_http_response(r)
-                    
-                elif self.days > 0 and age > self.days:
-                    #delete object
-                    logging.info("deleting stale object:" + fqon)
-                    r = self.conn.delete(self.bucket_name, fqon)
-                    util.check_http_response(r)
+        stale = stale_fqons(fqons, self.days, self.copies)
+        for fqon in stale:
+            logging.info("deleting stale object:" + fqon)
+        util.delete_keys(self.conn, self.bucket_name, stale)
                 
     
     def __del__(self):
-        self.scratch()
+        if self.auto_scratch:
+            self.scratch()
         
 
 s3archive = S3Archive
@@ -0,0 +1,229 @@
+from collections import OrderedDict
+import errno
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from lib import S3
+from S3Errors import *
+from util import *
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None #no cross-process locking, e.g. on windows
+
+__all__ = [
+       "S3ObjectCache", "s3objectcache"
+]
+
+class S3ObjectCache:
+    """ a local cache of object bodies for S3IO.  a cached object is still
+        checked against S3 on every read, with a conditional GET on its etag,
+        but an unchanged object costs a 304 with no body instead of a whole
+        download.
+
+        the most recently used objects are kept in memory, up to max_memory
+        bytes, and if a directory is given, on disk up to max_disk bytes.  the
+        directory may be shared by several processes: files are written to a
+        temporary name and renamed into place, and eviction holds a lock. """
+
+    def __init__(self, directory=None, max_memory=67108864, max_disk=1073741824):
+        self.directory = directory
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.memory = OrderedDict() #(bucket_name, object_name) -> (etag, S3Object), least recently used first
+        self.memory_len = 0
+        self.disk_len = None #bytes in the directory as of the last walk, plus what was stored since
+        self.lock = threading.Lock()
+
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, bucket_name, object_name):
+        return os.path.join(self.directory, hashlib.sha1('%s/%s' % (bucket_name, object_name)).hexdigest())
+
+    def _remember(self, key, etag, obj):
+        """ keep an object in memory, evicting the least recently used ones """
+        with self.lock:
+            if key in self.memory:
+                self.memory_len -= len(self.memory.pop(key)[1].data)
+            if len(obj.data) > self.max_memory:
+                return
+
+            self.memory[key] = (etag, obj)
+            self.memory_len += len(obj.data)
+            while self.memory_len > self.max_memory:
+                junk, (junk, evicted) = self.memory.popitem(last=False)
+                self.memory_len -= len(evicted.data)
+
+    def _lookup(self, bucket_name, object_name):
+        """ the cached (etag, S3Object) of an object, or None """
+        key = (bucket_name, object_name)
+        with self.lock:
+            entry = self.memory.pop(key, None)
+            if entry:
+                self.memory[key] = entry
+                return entry
+
+        if not self.directory:
+            return None
+
+        path = self._path(bucket_name, object_name)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+
+        try:
+            try:
+                names, etag, metadata = pickle.load(f)
+                data = f.read()
+            except Exception:
+                logging.warning('ignoring the unreadable cache file %s' % path)
+                return None
+        finally:
+            f.close()
+
+        if names != key:
+            return None #another object with the same hash
+
+        try:
+            os.utime(path, None) #disk eviction is least recently used first
+        except OSError:
+            pass
+
+        obj = S3.S3Object(data, metadata)
+        self._remember(key, etag, obj)
+        return etag, obj
+
+    def _store(self, bucket_name, object_name, etag, obj):
+        key = (bucket_name, object_name)
+        self._remember(key, etag, obj)
+        if not self.directory or len(obj.data) > self.max_disk:
+            return
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump((key, etag, obj.metadata), f, 2)
+                f.write(obj.data)
+                stored = f.tell()
+            finally:
+                f.close()
+            path = self._path(bucket_name, object_name)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                if not os.path.exists(path):
+                    raise
+                #windows won't rename over an existing file
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                try:
+                    os.rename(temp_path, path)
+                except OSError:
+                    if not os.path.exists(path):
+                        raise
+                    os.remove(temp_path) #another process stored it in between, keep theirs
+        except:
+            os.remove(temp_path)
+            raise
+
+        self._evict(stored)
+
+    def _evict(self, stored):
+        """ remove the least recently used files until the directory is back
+            under nine tenths of max_disk, leaving room for the next stores.
+            the directory is only walked when a running total of its size may
+            be over max_disk, so files stored by other processes are counted
+            at the next walk.  if another process is already evicting, leave 
+            it to it """
+        with self.lock:
+            if self.disk_len is not None:
+                self.disk_len += stored
+                if self.disk_len <= self.max_disk:
+                    return
+
+        lock_file = open(os.path.join(self.directory, '.lock'), 'a')
+        try:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    return
+
+            files = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if name.startswith('.'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue #evicted by someone else
+                files.append((st.st_mtime, st.st_size, name))
+                total += st.st_size
+
+            files.sort()
+            for mtime, size, name in files:
+                if total <= self.max_disk * 9 // 10:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                total -= size
+
+            with self.lock:
+                self.disk_len = total
+        finally:
+            lock_file.close()
+
+    def get(self, conn, bucket_name, object_name):
+        """ the object as an S3.S3Object, from the cache if it hasn't changed,
+            or None if it doesn't exist.  its metadata is a copy, so changing
+            it doesn't change what later readers get """
+        cached = self._lookup(bucket_name, object_name)
+        headers = {}
+        if cached:
+            headers['If-None-Match'] = cached[0]
+
+        r = conn.get(bucket_name, object_name, headers)
+        if r.http_response.status == 304:
+            logging.debug('%s/%s is unchanged, using the cached copy' % (bucket_name, object_name))
+            return S3.S3Object(cached[1].data, dict(cached[1].metadata))
+
+        if r.http_response.status == 404:
+            self.invalidate(bucket_name, object_name)
+            return None
+
+        check_http_response(r)
+        etag = r.http_response.getheader('ETag')
+        if etag:
+            self._store(bucket_name, object_name, etag, r.object)
+        return S3.S3Object(r.object.data, dict(r.object.metadata))
+
+    def invalidate(self, bucket_name, object_name):
+        """ forget an object, it has been overwritten or deleted """
+        with self.lock:
+            entry = self.memory.pop((bucket_name, object_name), None)
+            if entry:
+                self.memory_len -= len(entry[1].data)
+
+        if self.directory:
+            try:
+                os.remove(self._path(bucket_name, object_name))
+            except OSError:
+                pass
+
+s3objectcache = S3ObjectCache
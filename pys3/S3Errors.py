@@ -3,6 +3,7 @@ import exceptions
 __all__ = [
        "S3Error",
        "S3ResponseError",
+       "S3DeleteError",
 ]
 
 class S3Error(exceptions.Exception): pass
@@ -15,4 +16,14 @@ class S3ResponseError(S3Error):
         self.body = response.body
         
     def __str__(self):
-        return "%s - %s\n%s\n" % (self.status, self.reason, self.body)
\ No newline at end of file
+        return "%s - %s\n%s\n" % (self.status, self.reason, self.body)
+
+class S3DeleteError(S3Error):
+    """ some of the keys in a multi-object delete could not be deleted.  
+        errors holds the (key, code, message) of each of them """
+    def __init__(self, errors):
+        self.errors = errors
+        
+    def __str__(self):
+        return "%d keys could not be deleted\n%s\n" % (len(self.errors), 
+            '\n'.join(["%s - %s %s" % error for error in self.errors]))
\ No newline at end of file
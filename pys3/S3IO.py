@@ -1,21 +1,164 @@
 from StringIO import StringIO
+from collections import OrderedDict
+import errno
 import logging
+import re
+import tempfile
+import threading
 from lib import S3
 from S3Errors import *
+from S3Multipart import *
 from util import *
 
 __all__ = [
        "S3IOError",
-       "S3IO", "s3io"
+       "SpooledStringIO", "spooledstringio",
+       "S3IO", "s3io",
+       "S3WriteIO", "s3writeio",
+       "S3ReadIO", "s3readio",
+       "AsyncS3IO", "asyncs3io"
 ]
 
 class S3IOError(S3Error): pass
 
-class S3IO(StringIO):
-    """ read and write to an S3 object as if it were a StringIO object """
+def _ensure_bucket(conn, bucket_name):
+    """ make sure this bucket exists, otherwise create it """
+    try:
+        exists = conn.bucket_exists(bucket_name)
+    except S3.BucketError, e:
+        raise S3ResponseError, e.response
     
-    def __init__(self, conn, bucket_name, object_name, meta={}, buf=''):
+    if not exists:
+        response = conn.create_bucket(bucket_name)
+        check_http_response(response, 200)
+
+class SpooledStringIO(StringIO):
+    """ a StringIO that moves its contents to a temporary file, in dir, once
+        they grow past max_size bytes, like tempfile.SpooledTemporaryFile.  
+        after that, reads and writes go to the file and only the position
+        and length are kept in memory.  max_size=None never spills. """
+    
+    def __init__(self, buf='', max_size=None, dir=None):
         StringIO.__init__(self, buf)
+        self.max_size = max_size
+        self.dir = dir
+        self.file = None #the temporary file, once spilled
+        self._rollover()
+    
+    def _rollover(self):
+        if self.file is None and self.max_size is not None and self.len > self.max_size:
+            self.file = tempfile.TemporaryFile(dir=self.dir)
+            self.file.write(StringIO.getvalue(self))
+            self.buf = ''
+            self.buflist = []
+    
+    def read(self, n=-1):
+        if self.file is None:
+            return StringIO.read(self, n)
+        
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if self.pos >= self.len:
+            self.pos = self.len
+            return ''
+        remaining = self.len - self.pos
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        self.file.seek(self.pos)
+        data = self.file.read(n)
+        self.pos += len(data)
+        return data
+    
+    def readline(self, length=None):
+        if self.file is None:
+            return StringIO.readline(self, length)
+        
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if self.pos >= self.len:
+            self.pos = self.len
+            return ''
+        limit = self.len - self.pos
+        if length is not None and length >= 0:
+            limit = min(limit, length)
+        self.file.seek(self.pos)
+        line = self.file.readline(limit)
+        self.pos += len(line)
+        return line
+    
+    def truncate(self, size=None):
+        if self.file is None:
+            return StringIO.truncate(self, size)
+        
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if size is None:
+            size = self.pos
+        elif size < 0:
+            raise IOError(errno.EINVAL, "Negative size not allowed")
+        elif size < self.pos:
+            self.pos = size
+        if size < self.len:
+            self.file.truncate(size)
+            self.len = size
+    
+    def write(self, s):
+        if self.file is None:
+            StringIO.write(self, s)
+            self._rollover()
+            return
+        
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        s = str(s)
+        if not s:
+            return
+        self.file.seek(self.pos) #past the end, the file is padded with zeros like a StringIO
+        self.file.write(s)
+        self.pos += len(s)
+        self.len = max(self.len, self.pos)
+    
+    def getvalue(self):
+        if self.file is None:
+            return StringIO.getvalue(self)
+        
+        self.file.seek(0)
+        return self.file.read(self.len)
+    
+    def getbody(self):
+        """ the contents as a body for S3.AWSAuthConnection.put: the string,
+            or once spilled, the file, which put reads a chunk at a time. 
+            it isn't mapped into memory, where its pages would count 
+            against the process's RSS. """
+        if self.file is None:
+            return StringIO.getvalue(self)
+        
+        self.file.seek(0)
+        return S3.FileBody(self.file)
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        StringIO.close(self)
+
+spooledstringio = SpooledStringIO
+
+class S3IO(SpooledStringIO):
+    """ read and write to an S3 object as if it were a StringIO object.
+        the bucket is created if it doesn't exist, pass ensure_bucket=False
+        to skip the check when it is known to.  reads go through cache, an 
+        S3ObjectCache, if one is given.  once the buffer grows past 
+        spool_size bytes it moves to a temporary file in spool_dir and is 
+        uploaded from there, so a big object doesn't have to fit in memory. 
+        meta is stored as the object's x-amz-meta-* metadata, and reading 
+        the object replaces it with the metadata stored with the object, 
+        not the response headers. """
+    
+    def __init__(self, conn, bucket_name, object_name, meta={}, buf='', 
+                 multipart=False, part_size=8388608, parallelism=4, ensure_bucket=True,
+                 cache=None, spool_size=None, spool_dir=None):
+        SpooledStringIO.__init__(self, buf, spool_size, spool_dir)
         
         self.MAX_OBJECT_SIZE = 5368709120 #5GB
         self.conn = conn
@@ -23,22 +166,33 @@ class S3IO(StringIO):
         self.object_name = object_name
         self.key = '%s/%s' % (self.bucket_name, self.object_name)
         self.meta = meta
+        self.cache = cache
         self.sent_len = 0 #num bytes that have been sent to Amazon
         self.get_complete = False #tells if the get of the object has been completed
         self.closed = False
         
+        #multipart uploads send parts while the caller is still appending to the buffer
+        self.multipart = multipart
+        self.part_size = max(part_size, S3.MIN_PART_SIZE)
+        self.parallelism = parallelism
+        self.upload = None #the multipart upload in progress
+        self.streaming = multipart #true while every byte past shipped_len is in pending
+        self.shipped_len = 0 #num bytes handed to the upload as parts
+        self.pending = [] #appended strings that haven't made up a full part yet
+        self.pending_len = 0
+        if multipart:
+            self.MAX_OBJECT_SIZE = min(5497558138880, self.part_size * S3.MAX_PARTS) #5TB
+            if buf:
+                self.pending.append(str(buf))
+                self.pending_len = len(buf)
+        
         if buf:
             self.dirty = True
         else:
             self.dirty = False #any unflushed write will set dirty to true
         
-        #make sure this bucket exists, otherwise create it
-        response = self.conn.list_bucket(bucket_name)
-        if response.http_response.status == 404:
-            response = self.conn.create_bucket(bucket_name)
-            check_http_response(response, 200)
-        elif response.http_response.status != 200:
-            raise S3ResponseError, response
+        if ensure_bucket:
+            _ensure_bucket(self.conn, bucket_name)
     
     def __str__(self):
         return self.key
@@ -50,43 +204,131 @@ class S3IO(StringIO):
             
         if not self.dirty and not self.get_complete:
             logging.info('reading %s.%s' % (self.bucket_name, self.object_name))
-            r = self.conn.get(self.bucket_name, self.object_name)
+            if self.cache:
+                obj = self.cache.get(self.conn, self.bucket_name, self.object_name)
+            else:
+                r = self.conn.get(self.bucket_name, self.object_name)
+                if r.http_response.status == 404:
+                    obj = None
+                else:
+                    check_http_response(r)
+                    obj = r.object
             self.get_complete = True
             
-            if r.http_response.status == 404:
+            if obj is None:
                 return  #the object doesn't exist so just return
             
-            check_http_response(r)
             logging.debug('read successful')
-            self.write(r.object.data)
-            #TODO - set meta data
+            self._stop_streaming()
+            self.write(obj.data)
+            self.meta = obj.metadata
             self.seek(0)
             self.dirty = False
         
+    def stat(self):
+        """ the object's size, etag, last modified time and metadata as stored
+            in S3, as an S3.HeadResponse, or None if it doesn't exist.  the 
+            body isn't downloaded, and the answer may come from the 
+            connection's head cache, so a change made elsewhere can go 
+            unseen for up to the connection's head_cache_ttl seconds. """
+        r = self.conn.cached_head(self.bucket_name, self.object_name)
+        if r.http_response.status == 404:
+            return None
+        
+        check_http_response(r)
+        return r
+    
     def seek(self, pos, mode = 0):
         self._get_object()
-        return StringIO.seek(self, pos, mode)
+        return SpooledStringIO.seek(self, pos, mode)
             
     def read(self, n = -1):
         self._get_object()
-        return StringIO.read(self, n)
+        return SpooledStringIO.read(self, n)
     
     def readline(self, length=None):
         self._get_object()
-        return StringIO.readline(self, length)
+        return SpooledStringIO.readline(self, length)
     
     def truncate(self, size=None):
         self._get_object()
+        self._stop_streaming()
         self.dirty = True
-        StringIO.truncate(self, size)
+        SpooledStringIO.truncate(self, size)
     
     def write(self, s):
         self.dirty = True
-        StringIO.write(self, s)
+        if self.streaming:
+            if self.pos == self.len:
+                self._append_pending(s)
+            else:
+                self._stop_streaming() #overwrites data that may already be shipped
+        SpooledStringIO.write(self, s)
+    
+    def _append_pending(self, s):
+        """ queue an appended string, shipping each full part as soon as it's available """
+        s = str(s)
+        self.pending.append(s)
+        self.pending_len += len(s)
+        
+        if self.pending_len >= self.part_size:
+            data = ''.join(self.pending)
+            offset = 0
+            while self.pending_len - offset >= self.part_size:
+                self._ship_part(data[offset:offset+self.part_size])
+                offset += self.part_size
+            
+            self.pending = [data[offset:]]
+            self.pending_len -= offset
+    
+    def _ship_part(self, data):
+        if not self.upload:
+            self.upload = S3MultipartUpload(self.conn, self.bucket_name, self.object_name, 
+                                            self.meta, self.parallelism)
+        
+        self.upload.upload_part(len(self.upload.parts) + 1, data)
+        self.shipped_len += len(data)
+    
+    def _stop_streaming(self):
+        """ the buffer no longer matches the parts shipped so far, 
+            so a flush will have to upload all of it """
+        if self.upload:
+            try:
+                self.upload.abort()
+            except S3Error:
+                logging.exception('aborting the multipart upload of %s failed' % self.key)
+        
+        self.upload = None
+        self.streaming = False
+        self.pending = []
+        self.pending_len = 0
+    
+    def _flush_multipart(self):
+        """ finish the multipart upload, shipping whatever hasn't been sent yet """
+        if not self.streaming:
+            #upload the whole buffer, slicing it into parts without copying,
+            #a spilled buffer through an mmap of its file
+            if self.file is None:
+                obj = self.getvalue()
+            else:
+                self.file.seek(0)
+                obj = S3.request_body(self.file)
+            self.shipped_len = 0
+            while self.shipped_len < self.len:
+                self._ship_part(buffer(obj, self.shipped_len, self.part_size))
+        elif self.pending_len:
+            self._ship_part(''.join(self.pending))
+        
+        upload = self.upload
+        self.upload = None
+        self.streaming = False
+        self.pending = []
+        self.pending_len = 0
+        upload.complete()
         
     def flush(self):
         """ Write the whole buffer to Amazon's server, overwriting any existing object. """
-        StringIO.flush(self)
+        SpooledStringIO.flush(self)
         
         if not self.dirty:
             return #nothing has been written to the buffer, so there isn't anything to flush
@@ -100,29 +342,384 @@ class S3IO(StringIO):
         #if self.sent_len == self.len:
         #    return 
         
-        obj = self.getvalue()
-        
         logging.info('flushing %s.%s meta: %s' % (self.bucket_name, self.object_name, self.meta))
         
-        #write the full buffer    
-        response = self.conn.put(self.bucket_name,
-                                 self.object_name,
-                                 S3.S3Object(str(obj)),
-                                 self.meta)
+        if self.multipart and (self.upload or self.len > self.part_size):
+            self._flush_multipart()
+        else:
+            self._stop_streaming()
+            obj = self.getbody()
+            if isinstance(obj, unicode):
+                obj = str(obj)
             
-        if response.http_response.status != 200:
-            raise S3ResponseError, response            
+            #write the full buffer    
+            response = self.conn.put(self.bucket_name,
+                                     self.object_name,
+                                     S3.S3Object(obj, self.meta))
+                
+            if response.http_response.status != 200:
+                raise S3ResponseError, response            
         
         logging.debug('flush successful')
+        if self.cache:
+            self.cache.invalidate(self.bucket_name, self.object_name)
         self.sent_len = self.len
         self.dirty = False
             
     def close(self):
         if not self.closed:
             self.flush()
-            StringIO.close(self)  
+            SpooledStringIO.close(self)  
                 
     def __del__(self):
         self.close()
         
-s3io = S3IO
\ No newline at end of file
+s3io = S3IO
+
+class S3WriteIO:
+    """ write-only stream to an S3 object that never holds the whole object.
+        each chunk_size chunk is uploaded as a multipart part as soon as it fills,
+        so memory is bounded by chunk_size * (max_in_flight + 1) whatever the 
+        object's size.  the object appears in S3 when the stream is closed. """
+    
+    def __init__(self, conn, bucket_name, object_name, meta={}, chunk_size=8388608,
+                 parallelism=4, max_in_flight=4, ensure_bucket=True):
+        self.conn = conn
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.key = '%s/%s' % (self.bucket_name, self.object_name)
+        self.meta = meta
+        self.chunk_size = max(chunk_size, S3.MIN_PART_SIZE)
+        self.parallelism = parallelism
+        self.max_in_flight = max_in_flight
+        self.MAX_OBJECT_SIZE = min(5497558138880, self.chunk_size * S3.MAX_PARTS) #5TB
+        self.upload = None
+        self.chunk = [] #strings written since the last part was shipped
+        self.chunk_len = 0
+        self.len = 0 #num bytes written
+        self.closed = False
+        
+        if ensure_bucket:
+            _ensure_bucket(self.conn, bucket_name)
+    
+    def __str__(self):
+        return self.key
+    
+    def tell(self):
+        return self.len
+    
+    def write(self, s):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        
+        s = str(s)
+        if self.len + len(s) > self.MAX_OBJECT_SIZE:
+            raise S3IOError("String length must not exceed %s bytes." % self.MAX_OBJECT_SIZE)
+        
+        self.chunk.append(s)
+        self.chunk_len += len(s)
+        self.len += len(s)
+        
+        if self.chunk_len >= self.chunk_size:
+            data = ''.join(self.chunk)
+            offset = 0
+            while self.chunk_len - offset >= self.chunk_size:
+                self._ship_part(data[offset:offset+self.chunk_size])
+                offset += self.chunk_size
+            
+            self.chunk = [data[offset:]]
+            self.chunk_len -= offset
+    
+    def writelines(self, iterable):
+        for line in iterable:
+            self.write(line)
+    
+    def _ship_part(self, data):
+        if not self.upload:
+            self.upload = S3MultipartUpload(self.conn, self.bucket_name, self.object_name, self.meta, 
+                                            self.parallelism, max_in_flight=self.max_in_flight)
+        
+        self.upload.upload_part(len(self.upload.parts) + 1, data)
+    
+    def read(self, n=-1):
+        raise S3IOError("S3WriteIO is write-only.")
+    
+    def seek(self, pos, mode=0):
+        raise S3IOError("S3WriteIO can't seek.")
+    
+    def flush(self):
+        """ parts are shipped as they fill, the object is only complete once it's closed """
+        pass
+    
+    def abort(self):
+        """ throw away everything written, leaving any existing object untouched """
+        if self.upload:
+            self.upload.abort()
+        self.upload = None
+        self.chunk = []
+        self.closed = True
+    
+    def close(self):
+        if self.closed:
+            return
+        
+        self.closed = True
+        data = ''.join(self.chunk)
+        self.chunk = []
+        
+        if not self.upload:
+            if not data:
+                raise S3IOError("String length must be greater than zero.")
+            
+            logging.info('flushing %s.%s meta: %s' % (self.bucket_name, self.object_name, self.meta))
+            response = self.conn.put(self.bucket_name, self.object_name, S3.S3Object(data, self.meta))
+            check_http_response(response, 200)
+            return
+        
+        if data:
+            self._ship_part(data)
+        self.upload.complete()
+        logging.debug('stream to %s complete' % self.key)
+    
+    def __del__(self):
+        self.close()
+
+s3writeio = S3WriteIO
+
+class S3ReadIO:
+    """ read-only S3 object that only downloads the bytes that are read.
+        the object is fetched with HTTP Range requests in block_size blocks, 
+        and the most recently used cache_blocks blocks are kept.  a read that 
+        continues on from the last one fetches readahead blocks at once. """
+    
+    def __init__(self, conn, bucket_name, object_name, block_size=262144, 
+                 readahead=8, cache_blocks=64):
+        self.conn = conn
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.key = '%s/%s' % (self.bucket_name, self.object_name)
+        self.block_size = block_size
+        self.readahead = max(1, min(readahead, cache_blocks))
+        self.cache_blocks = cache_blocks
+        self.blocks = OrderedDict() #block index -> data, least recently used first
+        self.last_block = None #index of the last block read, to spot sequential reads
+        self.size = None #unknown until the first response
+        self.etag = None #every range must come from the same version of the object
+        self.pos = 0
+        self.closed = False
+        
+    def __str__(self):
+        return self.key
+    
+    def __iter__(self):
+        return self
+    
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+    
+    def _fetch(self, first, last, suffix=None):
+        """ get blocks first through last, or the final suffix bytes of the object """
+        if suffix:
+            byte_range = 'bytes=-%d' % suffix
+        else:
+            byte_range = 'bytes=%d-%d' % (first * self.block_size, (last + 1) * self.block_size - 1)
+        
+        headers = {'Range': byte_range}
+        if self.etag:
+            headers['If-Match'] = self.etag
+        
+        logging.debug('reading %s %s' % (self.key, byte_range))
+        r = self.conn.get(self.bucket_name, self.object_name, headers)
+        status = r.http_response.status
+        if status == 416:
+            #the range starts past the end, which says nothing about the data 
+            #before it.  only the first probe of an object finds it empty
+            match = re.match(r'bytes \*/(\d+)', r.http_response.getheader('Content-Range', ''))
+            if match:
+                self.size = int(match.group(1))
+            elif self.size is None:
+                self.size = 0
+            return
+        
+        if status == 404 and self.size is None:
+            self.size = 0 #missing, read it as an empty object
+            return
+        
+        if status == 412:
+            raise S3IOError("%s changed while it was being read." % self.key)
+        
+        check_http_response(r)
+        self.etag = r.http_response.getheader('ETag')
+        
+        if status == 206:
+            match = re.match(r'bytes (\d+)-(\d+)/(\d+)', r.http_response.getheader('Content-Range', ''))
+            start, self.size = int(match.group(1)), int(match.group(3))
+        else:
+            start, self.size = 0, len(r.object.data) #the whole object came back
+        
+        #keep only whole blocks, a suffix may begin part way through one
+        block = (start + self.block_size - 1) // self.block_size
+        offset = block * self.block_size - start
+        while offset < len(r.object.data):
+            self._cache(block, r.object.data[offset:offset+self.block_size])
+            block += 1
+            offset += self.block_size
+    
+    def _cache(self, index, data):
+        self.blocks.pop(index, None)
+        self.blocks[index] = data
+        while len(self.blocks) > self.cache_blocks:
+            self.blocks.popitem(last=False)
+    
+    def _block(self, index):
+        """ the data of one block, fetching it and any readahead if it isn't cached """
+        if index not in self.blocks:
+            last = index
+            if self.last_block is not None and index == self.last_block + 1:
+                #sequential read, get the next few blocks while we're at it
+                last = index + self.readahead - 1
+                if self.size is not None:
+                    last = min(last, (self.size - 1) // self.block_size)
+                for i in range(index + 1, last + 1):
+                    if i in self.blocks:
+                        last = i - 1
+                        break
+            
+            self._fetch(index, last)
+        
+        self.last_block = index
+        data = self.blocks.get(index, '')
+        if data:
+            self._cache(index, data)
+        return data
+    
+    def _get_size(self):
+        if self.size is None:
+            self._fetch(None, None, suffix=self.block_size)
+        return self.size
+    
+    def tell(self):
+        return self.pos
+    
+    def seek(self, pos, mode=0):
+        if mode == 1:
+            pos += self.pos
+        elif mode == 2:
+            pos += self._get_size()
+        self.pos = max(0, pos)
+    
+    def read(self, n=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        
+        chunks = []
+        while n < 0 or n > 0:
+            index, offset = divmod(self.pos, self.block_size)
+            if self.size is not None and self.pos >= self.size:
+                break
+            
+            data = self._block(index)[offset:]
+            if n >= 0:
+                data = data[:n]
+                n -= len(data)
+            if not data:
+                break
+            
+            chunks.append(data)
+            self.pos += len(data)
+        
+        return ''.join(chunks)
+    
+    def readline(self, length=None):
+        chunks = []
+        while length is None or length > 0:
+            index, offset = divmod(self.pos, self.block_size)
+            if self.size is not None and self.pos >= self.size:
+                break
+            
+            data = self._block(index)[offset:]
+            newline = data.find('\n')
+            if newline >= 0:
+                data = data[:newline+1]
+            if length is not None:
+                data = data[:length]
+                length -= len(data)
+            if not data:
+                break
+            
+            chunks.append(data)
+            self.pos += len(data)
+            if data.endswith('\n'):
+                break
+        
+        return ''.join(chunks)
+    
+    def readlines(self):
+        return list(self)
+    
+    def close(self):
+        self.blocks.clear()
+        self.closed = True
+
+s3readio = S3ReadIO
+
+class AsyncS3IO:
+    """ an S3IO whose operations return Futures instead of blocking.
+        operations on one object run in the order they were called, each one
+        starting when the one before it has finished """
+
+    def __init__(self, conn, bucket_name, object_name, meta={}, buf='', ensure_bucket=True,
+                 spool_size=None, spool_dir=None):
+        if isinstance(conn, S3.AsyncAWSAuthConnection):
+            conn = conn.conn
+
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.last = S3.Future()
+        self.last.set_result(None)
+        self.io = self._chain(lambda: S3IO(conn, bucket_name, object_name, meta, buf, 
+                                           ensure_bucket=ensure_bucket, spool_size=spool_size,
+                                           spool_dir=spool_dir))
+
+    def _chain(self, fn, *args):
+        future = S3.Future()
+        with self.lock:
+            previous, self.last = self.last, future
+
+        def finish(inner):
+            future.finish(inner.value, inner.exc_info)
+
+        def start(previous):
+            self.conn.submit(fn, *args).add_done_callback(finish)
+
+        previous.add_done_callback(start)
+        return future
+
+    def _call(self, name, *args):
+        return getattr(self.io.result(), name)(*args)
+
+    def read(self, n=-1):
+        return self._chain(self._call, 'read', n)
+
+    def readline(self, length=None):
+        return self._chain(self._call, 'readline', length)
+
+    def write(self, s):
+        return self._chain(self._call, 'write', s)
+
+    def seek(self, pos, mode=0):
+        return self._chain(self._call, 'seek', pos, mode)
+
+    def truncate(self, size=None):
+        return self._chain(self._call, 'truncate', size)
+
+    def flush(self):
+        return self._chain(self._call, 'flush')
+
+    def close(self):
+        return self._chain(self._call, 'close')
+
+asyncs3io = AsyncS3IO
\ No newline at end of file
@@ -0,0 +1,99 @@
+import logging
+import sys
+import threading
+from lib import S3
+from S3Errors import *
+from util import *
+
+__all__ = [
+       "S3MultipartError",
+       "S3MultipartUpload", "s3multipartupload"
+]
+
+class S3MultipartError(S3Error): pass
+
+class S3MultipartUpload:
+    """ upload one object as a series of parts.  parts are sent in parallel,
+        each on its own worker thread, and a part that fails is retried on its
+        own, by the connection's RetryPolicy, without disturbing the others.
+        if max_in_flight is given, 
+        upload_part blocks while that many parts are still being sent, which
+        bounds the memory held by unsent parts. """
+
+    def __init__(self, conn, bucket_name, object_name, meta={}, parallelism=4, max_in_flight=None):
+        self.conn = conn
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.parts = {} #part_number -> future for the part's etag
+        self.executor = S3.RequestExecutor(parallelism)
+        self.slots = None
+        if max_in_flight:
+            self.slots = threading.BoundedSemaphore(max_in_flight)
+
+        logging.info('starting multipart upload of %s.%s' % (bucket_name, object_name))
+        r = self.conn.initiate_multipart_upload(bucket_name, object_name, metadata=meta)
+        check_http_response(r)
+        self.upload_id = r.upload_id
+
+    def _upload_part(self, part_number, data):
+        """ send one part.  returns the part's etag """
+        r = self.conn.upload_part(self.bucket_name, self.object_name, self.upload_id, part_number, data)
+        if r.http_response.status != 200:
+            raise S3ResponseError, r
+
+        if r.retries:
+            logging.info('part %d of %s.%s was sent after %d retries' % 
+                         (part_number, self.bucket_name, self.object_name, r.retries))
+        return r.http_response.getheader('ETag')
+
+    def upload_part(self, part_number, data):
+        """ start sending a part in the background.  part numbers run from 1 to
+            MAX_PARTS, and every part but the last must be at least MIN_PART_SIZE """
+        if not 1 <= part_number <= S3.MAX_PARTS:
+            raise S3MultipartError("part_number must be between 1 and %d." % S3.MAX_PARTS)
+
+        if self.slots:
+            self.slots.acquire()
+        
+        future = self.executor.submit(self._upload_part, part_number, data)
+        if self.slots:
+            future.add_done_callback(lambda future: self.slots.release())
+        self.parts[part_number] = future
+
+    def complete(self):
+        """ wait for every part, then assemble them into the object.
+            the upload is aborted if any part could not be sent. """
+        try:
+            try:
+                parts = [(part_number, future.result()) for part_number, future in self.parts.items()]
+            except:
+                exc_info = sys.exc_info()
+                self.abort()
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            r = self.conn.complete_multipart_upload(self.bucket_name, self.object_name, self.upload_id, parts)
+            if r.http_response.status != 200:
+                self.abort()
+                raise S3ResponseError, r
+
+            if r.error_code:
+                self.abort()
+                raise S3MultipartError("completing the upload failed: %s" % r.error_code)
+        finally:
+            self.executor.shutdown(wait=False)
+
+        logging.debug('multipart upload complete')
+        return r
+
+    def abort(self):
+        """ discard the parts uploaded so far """
+        for future in self.parts.values():
+            future.wait()
+
+        logging.info('aborting multipart upload of %s.%s' % (self.bucket_name, self.object_name))
+        self.executor.shutdown(wait=False)
+        r = self.conn.abort_multipart_upload(self.bucket_name, self.object_name, self.upload_id)
+        if r.http_response.status not in (204, 404):
+            raise S3ResponseError, r
+
+s3multipartupload = S3MultipartUpload
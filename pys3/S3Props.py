@@ -0,0 +1,43 @@
+import threading
+import time
+
+__all__ = [
+       "PropsCache", "props_cache"
+]
+
+class PropsCache:
+    """ the props of archives, shared by every S3Archive in the process and 
+        keyed by host, bucket and object prefix.  props younger than ttl 
+        seconds are used as they are, older ones are revalidated against 
+        their etag. """
+    
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.entries = {} #(host, bucket_name, object_prefix) -> (props, etag, time cached)
+        self.lock = threading.Lock()
+    
+    def get(self, host, bucket_name, object_prefix):
+        """ the cached (props, etag, is_fresh), or None """
+        with self.lock:
+            entry = self.entries.get((host, bucket_name, object_prefix))
+        if not entry:
+            return None
+        props, etag, cached = entry
+        return props, etag, time.time() - cached < self.ttl
+    
+    def put(self, host, bucket_name, object_prefix, props, etag=None):
+        with self.lock:
+            self.entries[(host, bucket_name, object_prefix)] = (props, etag, time.time())
+    
+    def invalidate(self, host=None, bucket_name=None, object_prefix=None):
+        """ forget one archive's props, every archive's in a bucket, or every 
+            archive's """
+        with self.lock:
+            if object_prefix is not None:
+                self.entries.pop((host, bucket_name, object_prefix), None)
+            else:
+                for key in self.entries.keys():
+                    if bucket_name is None or key[:2] == (host, bucket_name):
+                        del self.entries[key]
+
+props_cache = PropsCache()
\ No newline at end of file
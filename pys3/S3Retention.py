@@ -0,0 +1,151 @@
+import logging
+import time
+from lib import S3
+from S3Errors import *
+from S3Archive import *
+import util
+
+__all__ = [
+       "S3RetentionReport", "s3retentionreport",
+       "S3Retention", "s3retention"
+]
+
+class S3RetentionReport:
+    """ what a sweep did to one archive.  exception is set, and the rest of
+        the report may be incomplete, if the archive could not be swept """
+
+    def __init__(self, object_prefix):
+        self.object_prefix = object_prefix
+        self.skipped = False #there was no props object, so the archive was left alone
+        self.days = None
+        self.copies = None
+        self.instances = 0
+        self.stale = 0
+        self.deleted = 0
+        self.errors = [] #(key, code, message) of each stale instance that couldn't be deleted
+        self.list_seconds = 0.0
+        self.delete_seconds = 0.0
+        self.exception = None
+
+    def __str__(self):
+        if self.exception:
+            return '<S3RetentionReport - %s failed: %s>' % (self.object_prefix, self.exception)
+        if self.skipped:
+            return '<S3RetentionReport - %s skipped, it has no props>' % self.object_prefix
+        return '<S3RetentionReport - %s %d instances, %d stale, %d deleted, %d errors, listed in %.2fs, deleted in %.2fs>' % (
+                self.object_prefix, self.instances, self.stale, self.deleted, len(self.errors),
+                self.list_seconds, self.delete_seconds)
+
+    def __repr__(self):
+        return self.__str__()
+
+class S3Retention:
+    """ enforce the retention of many archives in a bucket at once, like
+        calling scratch() on each of them.  archives are listed in parallel,
+        and their stale instances are deleted in batches by a pool of at most
+        max_deletes workers, shared by every archive.
+
+        if object_prefixes isn't given, the archives are discovered: every
+        object prefix in the bucket that has a props object is swept.
+        archives without a props object are skipped, rather than given the
+        default retention as scratch() would. """
+
+    def __init__(self, conn, bucket_name, object_prefixes=None, parallelism=8, max_deletes=4):
+        self.conn = conn
+        self.bucket_name = bucket_name
+        self.object_prefixes = object_prefixes
+        self.parallelism = parallelism
+        self.max_deletes = max_deletes
+
+    def discover(self):
+        """ the object prefixes in the bucket, every name before a period.  the
+            ones without a props object are skipped by sweep() """
+        logging.debug('discovering archives in %s' % self.bucket_name)
+        try:
+            return [item.prefix[:-1] for item in self.conn.iter_bucket(self.bucket_name, delimiter='.')
+                    if isinstance(item, S3.CommonPrefixEntry)]
+        except S3.ListError, e:
+            raise S3ResponseError, e.response
+
+    def _list(self, rkiv, report, set_default):
+        """ find the stale instances of an archive, None if it has no retention """
+        start = time.time()
+        try:
+            if not rkiv.load_retention(set_default):
+                logging.debug('%s has no props, skipping it' % rkiv)
+                report.skipped = True
+                return None
+
+            report.days = rkiv.days
+            report.copies = rkiv.copies
+            fqons = rkiv.list(parallelism=None)
+            report.instances = len(fqons)
+            stale = stale_fqons(fqons, rkiv.days, rkiv.copies)
+            report.stale = len(stale)
+            return stale
+        finally:
+            report.list_seconds = time.time() - start
+
+    def _delete(self, batch):
+        start = time.time()
+        responses = self.conn.delete_objects(self.bucket_name, batch)
+        for r in responses:
+            util.check_http_response(r)
+        return responses, time.time() - start
+
+    def sweep(self):
+        """ free the stale instances of every archive.  returns an
+            S3RetentionReport for each archive, in object prefix order """
+        set_default = self.object_prefixes is not None
+        object_prefixes = sorted(self.object_prefixes or self.discover())
+        logging.info('sweeping %d archives in %s' % (len(object_prefixes), self.bucket_name))
+
+        listers = S3.RequestExecutor(self.parallelism)
+        deleters = S3.RequestExecutor(self.max_deletes)
+        try:
+            reports = []
+            listings = {} # future -> the report of the archive it lists
+            for object_prefix in object_prefixes:
+                rkiv = S3Archive(self.conn, self.bucket_name, object_prefix, auto_scratch=False)
+                report = S3RetentionReport(object_prefix)
+                reports.append(report)
+                listings[listers.submit(self._list, rkiv, report, set_default)] = report
+
+            # batches are queued as each archive's listing finishes, so deletes
+            # start while later archives are still being listed
+            deletes = []
+            for listing in S3.as_completed(listings.keys()):
+                report = listings[listing]
+                try:
+                    stale = listing.result()
+                except Exception, e:
+                    logging.error('could not list %s.%s: %s' % (self.bucket_name, report.object_prefix, e))
+                    report.exception = e
+                    continue
+
+                batches = [stale[i:i + S3.MAX_DELETE_KEYS] for i in range(0, len(stale or []), S3.MAX_DELETE_KEYS)]
+                deletes.append((report, [(batch, deleters.submit(self._delete, batch)) for batch in batches]))
+
+            for report, batches in deletes:
+                for batch, future in batches:
+                    try:
+                        responses, seconds = future.result()
+                    except Exception, e:
+                        logging.error('could not delete from %s.%s: %s' % (self.bucket_name, report.object_prefix, e))
+                        report.exception = e
+                        continue
+
+                    report.delete_seconds += seconds
+                    for r in responses:
+                        report.errors.extend(r.errors)
+                    report.deleted += len(batch) - sum([len(r.errors) for r in responses])
+
+                logging.info(str(report))
+        finally:
+            listers.shutdown(wait=False)
+            deleters.shutdown(wait=False)
+
+        return reports
+
+s3retentionreport = S3RetentionReport
+s3retention = S3Retention
@@ -1,4 +1,7 @@
 from S3Errors import *
+from S3Multipart import *
+from S3Cache import *
 from S3IO import *
 from S3Archive import *
+from S3Retention import *
 from util import *
\ No newline at end of file
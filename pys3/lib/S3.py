@@ -9,20 +9,66 @@
 #  this software code. (c) 2006 Amazon Digital Services, Inc. or its
 #  affiliates.
 
+from array import array
 import base64
+import binascii
+import bisect
+import calendar
+from collections import OrderedDict
+import hashlib
 import hmac
 import httplib
+import mmap
+import multiprocessing
+import os
+import Queue
+import random
 import re
+import rfc822
 import sha
+import socket
+import stat
+import string
 import sys
+import threading
 import time
 import urllib
+import xml.parsers.expat
 import xml.sax
+from xml.sax.saxutils import escape
 
 DEFAULT_HOST = 's3.amazonaws.com'
 PORTS_BY_SECURITY = { True: 443, False: 80 }
 METADATA_PREFIX = 'x-amz-meta-'
 AMAZON_HEADER_PREFIX = 'x-amz-'
+# query string parameters that name a sub-resource and so are signed
+SUB_RESOURCES = ['acl', 'delete', 'logging', 'partNumber', 'torrent', 'uploadId', 'uploads']
+MIN_PART_SIZE = 5242880 # 5MB, every part but the last must be at least this big
+MAX_PARTS = 10000
+MAX_DELETE_KEYS = 1000 # keys a multi-object delete may name
+DEFAULT_CHUNK_SIZE = 65536 # bytes read from the socket at a time when streaming
+DEFAULT_SEND_CHUNK_SIZE = 1048576 # bytes of a request body handed to the socket at a time
+DEFAULT_DOWNLOAD_PART_SIZE = 8388608
+DEFAULT_LIST_PARALLELISM = 8
+DEFAULT_PRESIGN_BATCH = 10000 # keys handed to a worker process at a time by get_many
+# the characters a key space is split on when it has no common prefixes to split on
+SPLIT_CHARACTERS = '!-.' + string.digits + string.ascii_uppercase + '_' + string.ascii_lowercase
+
+# 64 bit integer arrays, python 2 arrays have no 'q' but 'l' is 64 bits on LP64 platforms
+try:
+    INT64_TYPECODE = array('q').typecode
+except ValueError:
+    INT64_TYPECODE = 'l'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_IDLE_TIMEOUT = 60 # seconds a kept-alive connection may sit unused
+DEFAULT_MAX_CONNECTION_AGE = 600 # seconds before a connection is recycled
+DEFAULT_BUCKET_NEGATIVE_TTL = 5 # seconds a bucket found missing is remembered as missing
+DEFAULT_HEAD_CACHE_SIZE = 10000 # HEAD responses a connection remembers
+DEFAULT_HEAD_CACHE_TTL = 60 # seconds a remembered HEAD response is trusted
+
+# errors that mean a kept-alive socket was closed by the other end while idle
+STALE_CONNECTION_ERRORS = (socket.error, httplib.BadStatusLine,
+                           httplib.CannotSendRequest, httplib.ResponseNotReady)
 
 # generates the aws canonical string for the given parameters
 def canonical_string(method, path, headers, expires=None):
@@ -60,13 +106,17 @@ def canonical_string(method, path, headers, expires=None):
     # don't include anything after the first ? in the resource...
     buf += "/%s" % path.split('?')[0]
 
-    # ...unless there is an acl or torrent parameter
-    if re.search("[&?]acl($|=|&)", path):
-        buf += "?acl"
-    elif re.search("[&?]torrent($|=|&)", path):
-        buf += "?torrent"
-    elif re.search("[&?]logging($|=|&)", path):
-        buf += "?logging"
+    # ...unless it names a sub-resource, such as acl or uploadId
+    if '?' in path:
+        sub_resources = []
+        for param in path.split('?', 1)[1].split('&'):
+            name = param.split('=', 1)[0]
+            if name in SUB_RESOURCES:
+                sub_resources.append(urllib.unquote_plus(param))
+
+        if sub_resources:
+            sub_resources.sort()
+            buf += "?" + "&".join(sub_resources)
 
     return buf
 
@@ -79,6 +129,363 @@ def encode(aws_secret_access_key, str, urlencode=False):
     else:
         return b64_hmac
 
+class Signer:
+    """ signs requests with the same output as canonical_string and encode,
+        but faster: headers are picked out in one pass, the canonical string
+        is built with a join, the hmac is copied from one already keyed with 
+        the secret, and the Date header is only formatted once a second. """
+
+    def __init__(self, aws_access_key_id, aws_secret_access_key):
+        self.aws_access_key_id = aws_access_key_id
+        self.aws_secret_access_key = aws_secret_access_key
+        self.hmac = hmac.new(aws_secret_access_key, digestmod=sha)
+        self.date = (None, None) # (second, formatted Date header)
+
+    # the keyed hmac can't be pickled, a worker process keys its own
+    def __getstate__(self):
+        return (self.aws_access_key_id, self.aws_secret_access_key)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def date_header(self):
+        now = int(time.time())
+        second, date = self.date
+        if second != now:
+            date = time.strftime("%a, %d %b %Y %X GMT", time.gmtime(now))
+            self.date = (now, date)
+        return date
+
+    def canonical_string(self, method, path, headers, expires=None):
+        content_md5 = content_type = ''
+        date = None
+        amz_headers = {}
+        for key in headers:
+            lk = key.lower()
+            if lk == 'content-md5':
+                content_md5 = headers[key].strip()
+            elif lk == 'content-type':
+                content_type = headers[key].strip()
+            elif lk == 'date':
+                date = headers[key].strip()
+            elif lk.startswith(AMAZON_HEADER_PREFIX):
+                amz_headers[lk] = headers[key].strip()
+
+        if 'x-amz-date' in amz_headers:
+            date = ''
+        if expires:
+            date = str(expires)
+
+        parts = [method, content_md5, content_type]
+        if date is not None:
+            parts.append(date)
+        for key in sorted(amz_headers):
+            parts.append("%s:%s" % (key, amz_headers[key]))
+
+        if '?' not in path:
+            parts.append("/" + path)
+        else:
+            path, query = path.split('?', 1)
+            sub_resources = [urllib.unquote_plus(param) for param in query.split('&')
+                             if param.split('=', 1)[0] in SUB_RESOURCES]
+            if sub_resources:
+                sub_resources.sort()
+                parts.append("/%s?%s" % (path, "&".join(sub_resources)))
+            else:
+                parts.append("/" + path)
+
+        return "\n".join(parts)
+
+    def sign(self, string_to_sign, urlencode=False):
+        digest = self.hmac.copy()
+        digest.update(string_to_sign)
+        b64_hmac = binascii.b2a_base64(digest.digest())[:-1]
+        if urlencode:
+            return urllib.quote_plus(b64_hmac)
+        return b64_hmac
+
+    def add_auth_header(self, headers, method, path):
+        if not headers.has_key('Date'):
+            headers['Date'] = self.date_header()
+
+        headers['Authorization'] = "AWS %s:%s" % (
+                self.aws_access_key_id, self.sign(self.canonical_string(method, path, headers)))
+
+    def sign_request(self, headers, method, path, data=''):
+        """ sign a request, returning the path and body to send it with """
+        self.add_auth_header(headers, method, path)
+        return path, data
+
+    def presign(self, method, path, headers, expires):
+        """ the path with query string parameters that authenticate it added """
+        signature = self.sign(self.canonical_string(method, path, headers, expires), True)
+        if '?' in path:
+            arg_div = '&'
+        else:
+            arg_div = '?'
+
+        return path + arg_div + "Signature=%s&Expires=%d&AWSAccessKeyId=%s" % (
+                signature, expires, self.aws_access_key_id)
+
+    def presign_keys(self, method, bucket, keys, headers, expires):
+        """ presign the same request for many keys in a bucket.  everything 
+            up to the key is canonicalized and hashed once, and each key 
+            only adds itself to a copy of that hmac. """
+        prepared = self.hmac.copy()
+        prepared.update(self.canonical_string(method, bucket + '/', headers, expires))
+        query = "&Expires=%d&AWSAccessKeyId=%s" % (expires, self.aws_access_key_id)
+
+        paths = []
+        for key in keys:
+            key = urllib.quote_plus(key)
+            digest = prepared.copy()
+            digest.update(key)
+            signature = urllib.quote_plus(binascii.b2a_base64(digest.digest())[:-1])
+            paths.append("%s/%s?Signature=%s%s" % (bucket, key, signature, query))
+        return paths
+
+SIGV4_ALGORITHM = 'AWS4-HMAC-SHA256'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+STREAMING_PAYLOAD = 'STREAMING-AWS4-HMAC-SHA256-PAYLOAD'
+EMPTY_SHA256 = hashlib.sha256('').hexdigest()
+
+def uri_encode(value, safe='-_.~'):
+    return urllib.quote(value, safe)
+
+class SigV4Signer:
+    """ signs requests with AWS Signature Version 4, for regions and S3 
+        compatible stores that don't take the older scheme.  pass one to
+        AWSAuthConnection or QueryStringAuthGenerator as signer.
+
+        the signing key is derived from the secret once a day, not on every
+        request.  bodies are hashed into the signature unless unsigned_payload
+        is set.  bodies bigger than chunk_size are sent aws-chunked, each 
+        chunk signed as it is sent, so the whole body is never hashed up 
+        front.  chunk_size=None turns that off. """
+
+    def __init__(self, aws_access_key_id, aws_secret_access_key, region='us-east-1', service='s3',
+                 unsigned_payload=False, chunk_size=DEFAULT_DOWNLOAD_PART_SIZE):
+        self.aws_access_key_id = aws_access_key_id
+        self.aws_secret_access_key = aws_secret_access_key
+        self.region = region
+        self.service = service
+        self.unsigned_payload = unsigned_payload
+        self.chunk_size = chunk_size
+        self.signing_key = (None, None) # (day, key derived for it)
+        self.timestamp = (None, None) # (second, x-amz-date for it)
+
+    def amz_date(self):
+        now = int(time.time())
+        second, timestamp = self.timestamp
+        if second != now:
+            timestamp = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(now))
+            self.timestamp = (now, timestamp)
+        return timestamp
+
+    def derive_key(self, day):
+        """ the signing key for a day, derived with four hmacs the first time """
+        cached_day, key = self.signing_key
+        if cached_day != day:
+            key = 'AWS4' + self.aws_secret_access_key
+            for part in (day, self.region, self.service, 'aws4_request'):
+                key = hmac.new(key, part, hashlib.sha256).digest()
+            self.signing_key = (day, key)
+        return key
+
+    def scope(self, day):
+        return '%s/%s/%s/aws4_request' % (day, self.region, self.service)
+
+    def canonical_path(self, path, extra_params=[]):
+        """ the path with its key and query string encoded the way SigV4
+            signs them.  keys and parameters arrive quote_plus'ed. """
+        resource, junk, query = path.partition('?')
+        parts = resource.split('/', 1)
+        uri = '/' + uri_encode(parts[0])
+        if len(parts) == 2:
+            uri += '/' + uri_encode(urllib.unquote_plus(parts[1]), '-_.~/')
+
+        params = []
+        for param in query.split('&'):
+            if param:
+                name, junk, value = param.partition('=')
+                params.append((urllib.unquote_plus(name), urllib.unquote_plus(value)))
+        params = sorted([(uri_encode(name), uri_encode(value)) for name, value in params + extra_params])
+        return uri, '&'.join(['%s=%s' % param for param in params])
+
+    def signature(self, key, string_to_sign):
+        return hmac.new(key, string_to_sign, hashlib.sha256).hexdigest()
+
+    def canonical_request(self, method, uri, query, headers, payload_hash):
+        """ the canonical request, and the signed header names, for headers
+            which are all signed """
+        canonical_headers = {}
+        for key in headers:
+            canonical_headers[key.lower()] = ' '.join(str(headers[key]).split())
+        names = sorted(canonical_headers)
+        signed_headers = ';'.join(names)
+
+        return '\n'.join([method, uri, query] + 
+                         ['%s:%s' % (name, canonical_headers[name]) for name in names] +
+                         ['', signed_headers, payload_hash]), signed_headers
+
+    def sign_request(self, headers, method, path, data=''):
+        """ sign a request, returning the path and body to send it with.  the
+            path is re-encoded to match what was signed, and a big body is 
+            wrapped to be sent aws-chunked.  headers must include Host. """
+        timestamp = self.amz_date()
+        day = timestamp[:8]
+        uri, query = self.canonical_path(path)
+
+        data = request_body(data)
+        size = body_length(data)
+        if self.chunk_size and size > self.chunk_size and not self.unsigned_payload:
+            payload_hash = STREAMING_PAYLOAD
+            headers['Content-Encoding'] = 'aws-chunked'
+            headers['x-amz-decoded-content-length'] = str(size)
+            headers['Content-Length'] = str(AwsChunkedBody.encoded_length(size, self.chunk_size))
+        elif self.unsigned_payload:
+            payload_hash = UNSIGNED_PAYLOAD
+        elif not size:
+            payload_hash = EMPTY_SHA256
+        elif hasattr(data, 'read'):
+            sha = hashlib.sha256()
+            while True:
+                chunk = data.read(DEFAULT_SEND_CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+            payload_hash = sha.hexdigest()
+            data.seek(0)
+        else:
+            payload_hash = hashlib.sha256(data).hexdigest()
+
+        headers['x-amz-date'] = timestamp
+        headers['x-amz-content-sha256'] = payload_hash
+        for key in headers.keys():
+            if key.lower() == 'authorization':
+                del headers[key]
+
+        request, signed_headers = self.canonical_request(method, uri, query, headers, payload_hash)
+        key = self.derive_key(day)
+        string_to_sign = '\n'.join([SIGV4_ALGORITHM, timestamp, self.scope(day), hashlib.sha256(request).hexdigest()])
+        signature = self.signature(key, string_to_sign)
+        headers['Authorization'] = '%s Credential=%s/%s, SignedHeaders=%s, Signature=%s' % (
+                SIGV4_ALGORITHM, self.aws_access_key_id, self.scope(day), signed_headers, signature)
+
+        path = uri[1:]
+        if query:
+            path += '?' + query
+        if payload_hash == STREAMING_PAYLOAD:
+            data = AwsChunkedBody(data, size, self.chunk_size, key, timestamp, self.scope(day), signature)
+        return path, data
+
+    def presign(self, method, path, headers, expires):
+        """ the path, re-encoded, with query string parameters that 
+            authenticate it added.  headers must include Host.  the payload
+            is always unsigned. """
+        timestamp = self.amz_date()
+        day = timestamp[:8]
+
+        signed = {}
+        for key in headers:
+            signed[key.lower()] = headers[key]
+        uri, query = self.canonical_path(path, [
+            ('X-Amz-Algorithm', SIGV4_ALGORITHM),
+            ('X-Amz-Credential', '%s/%s' % (self.aws_access_key_id, self.scope(day))),
+            ('X-Amz-Date', timestamp),
+            ('X-Amz-Expires', str(max(0, expires - int(time.time())))),
+            ('X-Amz-SignedHeaders', ';'.join(sorted(signed))),
+        ])
+
+        request, signed_headers = self.canonical_request(method, uri, query, signed, UNSIGNED_PAYLOAD)
+        string_to_sign = '\n'.join([SIGV4_ALGORITHM, timestamp, self.scope(day), hashlib.sha256(request).hexdigest()])
+        return '%s?%s&X-Amz-Signature=%s' % (uri[1:], query, self.signature(self.derive_key(day), string_to_sign))
+
+    def presign_keys(self, method, bucket, keys, headers, expires):
+        """ presign the same request for many keys in a bucket """
+        return [self.presign(method, '%s/%s' % (bucket, urllib.quote_plus(key)), headers, expires)
+                for key in keys]
+
+class AwsChunkedBody:
+    """ a request body sent aws-chunked: each chunk_size chunk of data is
+        prefixed with its signature, chained from the request's, as it is 
+        read.  data is a body from request_body of size bytes. """
+
+    def __init__(self, data, size, chunk_size, signing_key, timestamp, scope, seed_signature):
+        self.data = data
+        self.size = size
+        self.chunk_size = chunk_size
+        self.signing_key = signing_key
+        self.prefix = '\n'.join(['AWS4-HMAC-SHA256-PAYLOAD', timestamp, scope])
+        self.seed_signature = seed_signature
+        self.seek(0)
+
+    @staticmethod
+    def encoded_length(size, chunk_size):
+        """ the Content-Length of size bytes sent aws-chunked """
+        def chunk_length(n):
+            return len('%x' % n) + len(';chunk-signature=') + 64 + 2 + n + 2
+
+        full, rest = divmod(size, chunk_size)
+        length = full * chunk_length(chunk_size) + chunk_length(0)
+        if rest:
+            length += chunk_length(rest)
+        return length
+
+    def seek(self, offset):
+        """ only rewinding is supported, for a retried request """
+        if offset:
+            raise ValueError("an aws-chunked body can only be rewound")
+        if hasattr(self.data, 'seek'):
+            self.data.seek(0)
+        self.offset = 0
+        self.previous_signature = self.seed_signature
+        self.pending = '' # the encoded chunk being read
+        self.pending_offset = 0 # how much of it has been read
+        self.finished = False
+
+    def next_chunk(self):
+        if hasattr(self.data, 'read'):
+            chunk = self.data.read(min(self.chunk_size, self.size - self.offset))
+        else:
+            chunk = self.data[self.offset:self.offset + self.chunk_size]
+            if isinstance(chunk, memoryview):
+                chunk = chunk.tobytes()
+        self.offset += len(chunk)
+
+        string_to_sign = '\n'.join([self.prefix, self.previous_signature, EMPTY_SHA256, 
+                                    hashlib.sha256(chunk).hexdigest()])
+        signature = hmac.new(self.signing_key, string_to_sign, hashlib.sha256).hexdigest()
+        self.previous_signature = signature
+        if not chunk:
+            self.finished = True
+        return '%x;chunk-signature=%s\r\n%s\r\n' % (len(chunk), signature, chunk)
+
+    def read(self, amt=-1):
+        """ read from an offset into the encoded chunk, rather than slicing off
+            what's left of it on every read """
+        pieces = []
+        while amt:
+            if self.pending_offset == len(self.pending):
+                if self.finished:
+                    break
+                self.pending, self.pending_offset = self.next_chunk(), 0
+
+            end = len(self.pending)
+            if amt > 0:
+                end = min(end, self.pending_offset + amt)
+                amt -= end - self.pending_offset
+            pieces.append(self.pending[self.pending_offset:end])
+            self.pending_offset = end
+        return ''.join(pieces)
+
+# the bucket and unquoted key a request path refers to
+def split_path(path):
+    parts = path.split('?')[0].split('/', 1)
+    if len(parts) == 1:
+        return parts[0], ''
+    return parts[0], urllib.unquote_plus(parts[1])
+
 def merge_meta(headers, metadata):
     final_headers = headers.copy()
     for k in metadata.keys():
@@ -86,25 +493,645 @@ def merge_meta(headers, metadata):
 
     return final_headers
 
+def request_body(data):
+    """ a request body that can be sent without copying it into a string.  
+        strings and memoryviews are sent as they are, unicode as utf-8, and
+        mmaps and other objects with the buffer interface through a buffer 
+        of them.  a regular file is mapped into memory from its current 
+        position to its end, other file-like objects are read a chunk at a
+        time.  a file-like object must be seekable, so that its length is 
+        known and it can be sent again, or ValueError is raised. """
+    if isinstance(data, (str, buffer, memoryview, FileBody)):
+        return data
+    if isinstance(data, unicode):
+        return data.encode('utf-8')
+    if isinstance(data, mmap.mmap) or not hasattr(data, 'read'):
+        return buffer(data)
+    if not hasattr(data, 'seek'):
+        try:
+            return buffer(data) # e.g. an array, whose read is the old name of fromfile
+        except TypeError:
+            raise ValueError("a request body read from %r must be seekable" % data)
+
+    try:
+        if hasattr(data, 'flush'):
+            data.flush()
+        fileno = data.fileno()
+        start = data.tell()
+        st = os.fstat(fileno)
+    except (AttributeError, IOError, OSError, ValueError):
+        return FileBody(data) # no file descriptor, e.g. a StringIO
+    if not stat.S_ISREG(st.st_mode):
+        return FileBody(data)
+    if st.st_size <= start:
+        return ''
+
+    # mmap offsets must fall on a page, the buffer skips to the file's position
+    offset = start - start % mmap.ALLOCATIONGRANULARITY
+    region = mmap.mmap(fileno, st.st_size - offset, access=mmap.ACCESS_READ, offset=offset)
+    return buffer(region, start - offset)
+
+def body_length(data):
+    """ the number of bytes in a body from request_body """
+    if isinstance(data, memoryview):
+        return len(data) * data.itemsize
+    return len(data)
+
+def send_body(connection, data, chunk_size=DEFAULT_SEND_CHUNK_SIZE):
+    """ write a request body to a connection whose headers have been sent.
+        buffers are handed over a slice at a time without copying them, 
+        since an ssl socket copies what remains of a body on every send. """
+    if hasattr(data, 'read'):
+        while True:
+            chunk = data.read(chunk_size)
+            if not chunk:
+                break
+            connection.send(chunk)
+    elif isinstance(data, memoryview):
+        for offset in range(0, len(data), chunk_size):
+            connection.send(data[offset:offset + chunk_size])
+    else:
+        for offset in range(0, len(data), chunk_size):
+            connection.send(buffer(data, offset, chunk_size))
+
+class FileBody:
+    """ a request body read from a file-like object, from its position when
+        given to its end.  seek(0) rewinds it to that position, for a retry. """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        try:
+            self.start = fileobj.tell()
+            fileobj.seek(0, 2)
+            self.length = fileobj.tell() - self.start
+            fileobj.seek(self.start)
+        except (IOError, OSError):
+            raise ValueError("a request body read from %r must be seekable, not a pipe or socket" % fileobj)
+        self.remaining = self.length
+
+    def __len__(self):
+        return self.length
+
+    def seek(self, offset):
+        self.fileobj.seek(self.start + offset)
+        self.remaining = self.length - offset
+
+    def read(self, amt=-1):
+        if amt < 0 or amt > self.remaining:
+            amt = self.remaining
+        data = self.fileobj.read(amt)
+        self.remaining -= len(data)
+        return data
+
+
+class DownloadError(Exception):
+    """ download_to couldn't produce a complete copy of one version of the object """
+    def __init__(self, message, response=None):
+        Exception.__init__(self, message)
+        self.response = response
+
+
+class ListError(Exception):
+    """ iter_bucket got an error response for one of the pages """
+    def __init__(self, bucket, response):
+        Exception.__init__(self, "listing %s failed with %d" % (bucket, response.http_response.status))
+        self.response = response
+
+class BucketError(Exception):
+    """ bucket_exists got an error response other than 404 """
+    def __init__(self, bucket, response):
+        Exception.__init__(self, "checking %s failed with %d" % (bucket, response.http_response.status))
+        self.response = response
+
+
+class PooledHTTPResponse(httplib.HTTPResponse):
+    """ an HTTPResponse that hands its connection back to the pool once the
+        body has been read to the end.  a response that is closed early can't
+        leave its socket in a usable state, so that connection is discarded. """
+    pool = None
+    pooled_connection = None
+    reading_chunks = False # httplib closes a chunked response once it has read the terminator
+    chunks_complete = False
+
+    def read(self, amt=None):
+        try:
+            return httplib.HTTPResponse.read(self, amt)
+        except:
+            self.abandon() # the socket is somewhere in the middle of the body
+            raise
+
+    def _read_chunked(self, amt):
+        self.reading_chunks = True
+        try:
+            data = httplib.HTTPResponse._read_chunked(self, amt)
+        finally:
+            self.reading_chunks = False
+
+        if self.chunks_complete:
+            self.hand_back(True)
+        return data
+
+    def close(self):
+        if self.reading_chunks:
+            # _read_chunked hands the connection back if the read succeeds
+            self.chunks_complete = True
+            httplib.HTTPResponse.close(self)
+            return
+
+        reusable = self.fp is not None and self.length == 0
+        httplib.HTTPResponse.close(self)
+        self.hand_back(reusable)
+
+    def hand_back(self, reusable):
+        pool, self.pool = self.pool, None
+        if pool:
+            if reusable:
+                pool.checkin(self.pooled_connection)
+            else:
+                pool.discard(self.pooled_connection)
+
+    def abandon(self):
+        """ stop reading part way through the body, dropping the connection """
+        httplib.HTTPResponse.close(self)
+        self.hand_back(False)
+
+class ConnectionPool:
+    """ keeps up to size persistent connections to one host.  each connection
+        is checked out by exactly one request at a time and checked back in
+        when that request's response has been read.  idle connections are
+        evicted after idle_timeout seconds, and any connection older than
+        max_age seconds is recycled. """
+
+    def __init__(self, server, port, is_secure=True, size=DEFAULT_POOL_SIZE,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_age=DEFAULT_MAX_CONNECTION_AGE):
+        self.host = "%s:%d" % (server, port)
+        self.is_secure = is_secure
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.idle = []
+        self.num_connections = 0 # idle plus checked out
+        self.cond = threading.Condition()
+
+    def new_connection(self):
+        if self.is_secure:
+            connection = httplib.HTTPSConnection(self.host)
+        else:
+            connection = httplib.HTTPConnection(self.host)
+
+        connection.response_class = PooledHTTPResponse
+        connection.created = connection.last_used = time.time()
+        return connection
+
+    def is_expired(self, connection, now):
+        if self.max_age and now - connection.created > self.max_age:
+            return True
+        return bool(self.idle_timeout) and now - connection.last_used > self.idle_timeout
+
+    def evict(self):
+        """ close idle connections that have timed out or grown too old.
+            the caller must hold self.cond """
+        now = time.time()
+        for connection in self.idle[:]:
+            if self.is_expired(connection, now):
+                self.idle.remove(connection)
+                self.num_connections -= 1
+                connection.close()
+
+    def checkout(self):
+        """ get a connection for the exclusive use of one request, blocking
+            while all size connections are in use """
+        with self.cond:
+            self.evict()
+            while not self.idle and self.num_connections >= self.size:
+                self.cond.wait()
+                self.evict()
+
+            if self.idle:
+                return self.idle.pop() # most recently used, least likely to be stale
+
+            self.num_connections += 1
+
+        return self.new_connection()
+
+    def checkin(self, connection):
+        with self.cond:
+            connection.last_used = time.time()
+            if self.is_expired(connection, connection.last_used):
+                self.num_connections -= 1
+                connection.close()
+            else:
+                self.idle.append(connection)
+            self.cond.notify()
+
+    def discard(self, connection):
+        connection.close()
+        with self.cond:
+            self.num_connections -= 1
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            for connection in self.idle:
+                connection.close()
+            self.num_connections -= len(self.idle)
+            self.idle = []
+
+
+class RetryBudget:
+    """ a token bucket shared by every request on a connection.  each retry
+        spends retry_cost tokens and each success earns success_refund back, so
+        when most requests are failing, retries stop instead of piling on. """
+
+    def __init__(self, capacity=500, retry_cost=5, success_refund=1):
+        self.capacity = capacity
+        self.retry_cost = retry_cost
+        self.success_refund = success_refund
+        self.tokens = capacity
+        self.lock = threading.Lock()
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < self.retry_cost:
+                return False
+            self.tokens -= self.retry_cost
+            return True
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + self.success_refund)
+
+class RetryPolicy:
+    """ decides which failed requests make_request retries, and how long it
+        waits first.  5xx responses (such as 503 SlowDown) are retried for any
+        method.  a socket error may strike after S3 acted on the request, so 
+        those are only retried for idempotent methods.  delays grow 
+        exponentially from base_delay with full jitter, capped at max_delay.
+        max_attempts=1 turns retries off. """
+
+    def __init__(self, max_attempts=4, base_delay=0.1, max_delay=20,
+                 retryable_statuses=(500, 502, 503, 504),
+                 idempotent_methods=('GET', 'HEAD', 'PUT', 'DELETE'), budget=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable_statuses = retryable_statuses
+        self.idempotent_methods = idempotent_methods
+        self.budget = budget or RetryBudget()
+
+    def allows_retry(self, method, status, attempt):
+        """ status is None when the request failed without a response """
+        if attempt + 1 >= self.max_attempts:
+            return False
+        if status is None:
+            if method not in self.idempotent_methods:
+                return False
+        elif status not in self.retryable_statuses:
+            return False
+        return self.budget.withdraw()
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def record_success(self):
+        self.budget.deposit()
+
+class TokenBucket:
+    """ allows rate requests a second on average, in bursts of up to burst """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ take a token, sleeping until one is available """
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class AdaptiveConcurrency:
+    """ limits the number of requests in flight, finding the limit by AIMD: 
+        each success raises it by about one per window of requests, and each
+        503 SlowDown multiplies it by decrease_factor. """
+
+    def __init__(self, initial=10, minimum=1, maximum=256, decrease_factor=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, status):
+        with self.cond:
+            self.in_flight -= 1
+            if status == 503:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            elif status is not None and status < 500:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.cond.notifyAll()
+
+class RateLimiter:
+    """ throttles the requests made on a connection, and so every S3IO and
+        S3Archive built on it.  bucket_rate and prefix_rate cap the requests
+        per second to each bucket and to each key prefix in a bucket (the key
+        up to its last delimiter).  concurrency is an optional 
+        AdaptiveConcurrency shared by all requests.  any object with the same
+        acquire and release methods can be given to AWSAuthConnection instead. """
+
+    def __init__(self, bucket_rate=None, prefix_rate=None, delimiter='/',
+                 concurrency=None, max_prefixes=10000):
+        self.bucket_rate = bucket_rate
+        self.prefix_rate = prefix_rate
+        self.delimiter = delimiter
+        self.concurrency = concurrency
+        self.max_prefixes = max_prefixes
+        self.buckets = {} # (bucket, prefix) -> TokenBucket, prefix is None for the whole bucket
+        self.lock = threading.Lock()
+
+    def token_bucket(self, name, rate):
+        with self.lock:
+            token_bucket = self.buckets.get(name)
+            if not token_bucket:
+                if len(self.buckets) >= self.max_prefixes:
+                    self.buckets.clear()
+                token_bucket = self.buckets[name] = TokenBucket(rate)
+            return token_bucket
+
+    def acquire(self, method, bucket, key):
+        if self.bucket_rate:
+            self.token_bucket((bucket, None), self.bucket_rate).acquire()
+        if self.prefix_rate and key:
+            prefix = ''
+            if self.delimiter in key:
+                prefix = key.rsplit(self.delimiter, 1)[0]
+            self.token_bucket((bucket, prefix), self.prefix_rate).acquire()
+        if self.concurrency:
+            self.concurrency.acquire()
+
+    def release(self, method, bucket, key, status):
+        """ status is None when the request failed without a response """
+        if self.concurrency:
+            self.concurrency.release(status)
+
+class LRUCache:
+    """ a thread safe mapping of at most max_entries, which drops the least
+        recently used entry to make room """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class Future:
+    """ the eventual result of a call run by a RequestExecutor """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.is_done = False
+        self.value = None
+        self.exc_info = None
+        self.callbacks = []
+
+    def done(self):
+        return self.is_done
+
+    def wait(self, timeout=None):
+        with self.cond:
+            if not self.is_done:
+                self.cond.wait(timeout)
+            return self.is_done
+
+    def result(self, timeout=None):
+        """ the return value of the call, re-raising anything it raised """
+        if not self.wait(timeout):
+            raise RuntimeError("call did not finish within %s seconds" % timeout)
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+    def exception(self, timeout=None):
+        if not self.wait(timeout):
+            raise RuntimeError("call did not finish within %s seconds" % timeout)
+        if self.exc_info:
+            return self.exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        """ call fn(future) once the call finishes, right away if it already has """
+        with self.cond:
+            if not self.is_done:
+                self.callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, value):
+        self.finish(value, None)
+
+    def set_exception(self, exc_info):
+        self.finish(None, exc_info)
+
+    def finish(self, value, exc_info):
+        with self.cond:
+            self.value = value
+            self.exc_info = exc_info
+            self.is_done = True
+            self.cond.notifyAll()
+            callbacks, self.callbacks = self.callbacks, []
+
+        for fn in callbacks:
+            fn(self)
+
+def as_completed(futures):
+    """ yield each of futures once its call has finished, in the order they finish """
+    finished = Queue.Queue()
+    for future in futures:
+        future.add_done_callback(finished.put)
+    for i in range(len(futures)):
+        yield finished.get()
+
+class RequestExecutor:
+    """ runs calls on up to max_workers threads, started as they are needed """
+
+    def __init__(self, max_workers=DEFAULT_POOL_SIZE):
+        self.max_workers = max_workers
+        self.queue = Queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.is_shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        with self.lock:
+            if self.is_shutdown:
+                raise RuntimeError("cannot submit to an executor that has been shut down")
+
+            future = Future()
+            self.queue.put((future, fn, args, kwargs))
+            if len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self.work)
+                thread.setDaemon(True)
+                thread.start()
+                self.threads.append(thread)
+
+        return future
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            future, fn, args, kwargs = item
+            try:
+                value = fn(*args, **kwargs)
+            except:
+                future.set_exception(sys.exc_info())
+            else:
+                future.set_result(value)
+
+    def shutdown(self, wait=True):
+        """ stop the worker threads once the calls already submitted have run """
+        with self.lock:
+            self.is_shutdown = True
+            for thread in self.threads:
+                self.queue.put(None)
+
+        if wait:
+            for thread in self.threads:
+                thread.join()
 
 
 class AWSAuthConnection:
     def __init__(self, aws_access_key_id, aws_secret_access_key, is_secure=True,
-                 server=DEFAULT_HOST, port=None):
+                 server=DEFAULT_HOST, port=None, pool_size=DEFAULT_POOL_SIZE,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_age=DEFAULT_MAX_CONNECTION_AGE,
+                 max_workers=None, retry_policy=None, rate_limiter=None,
+                 bucket_negative_ttl=DEFAULT_BUCKET_NEGATIVE_TTL, head_cache_size=DEFAULT_HEAD_CACHE_SIZE,
+                 head_cache_ttl=DEFAULT_HEAD_CACHE_TTL, signer=None):
 
         if not port:
             port = PORTS_BY_SECURITY[is_secure]
 
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
-        if (is_secure):
-            self.connection = httplib.HTTPSConnection("%s:%d" % (server, port))
+        # the signature version 2 Signer, unless another, such as a SigV4Signer, is given
+        self.signer = signer or Signer(aws_access_key_id, aws_secret_access_key)
+        self.host = server
+        if port != PORTS_BY_SECURITY[is_secure]:
+            self.host = '%s:%d' % (server, port)
+        self.pool = ConnectionPool(server, port, is_secure, pool_size, idle_timeout, max_age)
+        self.max_workers = max_workers or pool_size
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.bucket_negative_ttl = bucket_negative_ttl
+        self.known_buckets = {} # bucket -> (whether it exists, when that was learned)
+        self.head_cache = LRUCache(head_cache_size) # (bucket, key) -> (HeadResponse, when it was received)
+        self.head_cache_ttl = head_cache_ttl
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def close(self):
+        """ stop the executor and close every idle connection in the pool """
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+        self.pool.close()
+
+    def get_executor(self):
+        with self.lock:
+            if not self.executor:
+                self.executor = RequestExecutor(self.max_workers)
+            return self.executor
+
+    def submit(self, operation, *args, **kwargs):
+        """ run an operation in the background and return a Future for its
+            response.  operation is the name of a method on this connection,
+            e.g. submit('GET', bucket, key) or submit('list_bucket', bucket),
+            or any callable. """
+        if callable(operation):
+            fn = operation
         else:
-            self.connection = httplib.HTTPConnection("%s:%d" % (server, port))
+            fn = getattr(self, operation.lower())
+
+        return self.get_executor().submit(fn, *args, **kwargs)
 
 
     def create_bucket(self, bucket, headers={}):
-        return Response(self.make_request('PUT', bucket, headers))
+        response = Response(self.make_request('PUT', bucket, headers))
+        if response.http_response.status == 200:
+            self.remember_bucket(bucket, True)
+        return response
+
+    def head_bucket(self, bucket, headers={}):
+        return Response(self.make_request('HEAD', bucket, headers))
+
+    def bucket_exists(self, bucket):
+        """ whether a bucket exists, probed with a HEAD request unless it is
+            already known.  buckets that exist are remembered until they are
+            deleted, ones that don't only for bucket_negative_ttl seconds.
+            raises BucketError on an error response other than 404. """
+        with self.lock:
+            known = self.known_buckets.get(bucket)
+        if known:
+            exists, learned = known
+            if exists or time.time() - learned < self.bucket_negative_ttl:
+                return exists
+
+        response = self.head_bucket(bucket)
+        if response.http_response.status not in (200, 404):
+            raise BucketError(bucket, response)
+
+        exists = response.http_response.status == 200
+        self.remember_bucket(bucket, exists)
+        return exists
+
+    def remember_bucket(self, bucket, exists):
+        with self.lock:
+            self.known_buckets[bucket] = (exists, time.time())
 
     def list_bucket(self, bucket, options={}, headers={}):
         path = bucket
@@ -113,28 +1140,388 @@ class AWSAuthConnection:
 
         return ListBucketResponse(self.make_request('GET', path, headers))
 
+    def iter_bucket(self, bucket, prefix=None, delimiter=None, marker=None, max_keys=None, headers={}):
+        """ yield every ListEntry in a bucket, and every CommonPrefixEntry when
+            a delimiter is given, in key order.  pages are requested as they
+            are needed, and the next page is fetched in the background while 
+            the current one is consumed.  raises ListError on an error response. """
+        options = {}
+        for name, value in (('prefix', prefix), ('delimiter', delimiter), ('max-keys', max_keys)):
+            if value is not None:
+                options[name] = value
+
+        if marker:
+            options['marker'] = marker
+
+        executor = RequestExecutor(1)
+        try:
+            page = executor.submit(self.list_bucket, bucket, dict(options), headers)
+            while page:
+                response = page.result()
+                page = None
+                if response.http_response.status >= 300:
+                    raise ListError(bucket, response)
+
+                items = response.entries
+                if response.common_prefixes:
+                    items = items + response.common_prefixes
+                    items.sort(key=lambda item: getattr(item, 'key', None) or item.prefix)
+
+                if response.is_truncated and items:
+                    options['marker'] = response.next_marker or getattr(items[-1], 'key', None) or items[-1].prefix
+                    page = executor.submit(self.list_bucket, bucket, dict(options), headers)
+
+                for item in items:
+                    yield item
+        finally:
+            executor.shutdown(wait=False)
+
+    def iter_bucket_range(self, bucket, prefix=None, marker=None, end=None, max_keys=None, headers={}):
+        """ yield the ListEntry of every key after marker, up to and including
+            end, in key order.  raises ListError on an error response. """
+        for entry in self.iter_bucket(bucket, prefix, None, marker, max_keys, headers):
+            if end is not None and entry.key > end:
+                return
+            yield entry
+
+    def plan_partitions(self, bucket, prefix=None, marker=None, delimiter='/', headers={}):
+        """ the keys that split the part of a bucket after marker into 
+            partitions which can be listed independently.  the common prefixes
+            under prefix are used when there are some, otherwise the key space
+            is split on the character after prefix. """
+        options = {'delimiter': delimiter}
+        if prefix:
+            options['prefix'] = prefix
+        if marker:
+            options['marker'] = marker
+
+        response = self.list_bucket(bucket, options, headers)
+        if response.http_response.status >= 300:
+            raise ListError(bucket, response)
+
+        boundaries = [entry.prefix for entry in response.common_prefixes]
+        if len(boundaries) < 2:
+            boundaries = [(prefix or '') + c for c in SPLIT_CHARACTERS]
+
+        return sorted(boundary for boundary in boundaries if boundary > (marker or ''))
+
+    def partition_ranges(self, marker, boundaries, end=None):
+        """ split the keys after marker, up to end, into (marker, end) ranges 
+            at boundaries.  boundaries may be a function, called with marker,
+            that returns them """
+        if callable(boundaries):
+            boundaries = boundaries(marker)
+        boundaries = [boundary for boundary in boundaries
+                      if boundary > marker and (end is None or boundary < end)]
+        return zip([marker] + boundaries, boundaries + [end])
+
+    def iter_bucket_parallel(self, bucket, prefix=None, parallelism=DEFAULT_LIST_PARALLELISM,
+                             boundaries=None, max_keys=None, headers={}):
+        """ yield every ListEntry in a bucket, in key order, like iter_bucket, 
+            but list the bucket as partitions which are listed concurrently. 
+            a first page is listed on its own, so a small listing costs one
+            request.  the partitions come from boundaries, a sorted list of
+            keys or a function of the first page's last key that returns one,
+            or are discovered with plan_partitions.  a partition's 
+            entries are buffered while the partitions before it are consumed,
+            up to a page and a half per partition. """
+        options = {}
+        for name, value in (('prefix', prefix), ('max-keys', max_keys)):
+            if value is not None:
+                options[name] = value
+
+        response = self.list_bucket(bucket, options, headers)
+        if response.http_response.status >= 300:
+            raise ListError(bucket, response)
+
+        for entry in response.entries:
+            yield entry
+        if not response.is_truncated or not response.entries:
+            return
+
+        marker = response.entries[-1].key
+        if boundaries is None:
+            boundaries = self.plan_partitions(bucket, prefix, marker, headers=headers)
+
+        stopped = threading.Event()
+        def offer(queue, item):
+            """ put item on queue unless the consumer has gone away """
+            while not stopped.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def list_range(queue, marker, end):
+            try:
+                for entry in self.iter_bucket_range(bucket, prefix, marker, end, max_keys, headers):
+                    if not offer(queue, entry):
+                        return
+            finally:
+                offer(queue, None)
+
+        executor = RequestExecutor(parallelism)
+        try:
+            pending = []
+            for marker, end in self.partition_ranges(marker, boundaries):
+                queue = Queue.Queue(3 * (max_keys or 1000) // 2)
+                pending.append((queue, executor.submit(list_range, queue, marker, end)))
+
+            for queue, future in pending:
+                for entry in iter(queue.get, None):
+                    yield entry
+                future.result()
+        finally:
+            stopped.set()
+            executor.shutdown(wait=False)
+
+    def list_bucket_columns(self, bucket, prefix=None, marker=None, max_keys=None, end=None,
+                            parallelism=None, boundaries=None, headers={}):
+        """ list every key in a bucket into a ListColumns, without making an
+            object per key.  if end is given, keys that sort after it are left
+            out.  if parallelism is given, what is left after the first page is
+            listed as partitions, concurrently, as in iter_bucket_parallel.
+            raises ListError on an error response. """
+        columns = ListColumns()
+        options = {}
+        for name, value in (('prefix', prefix), ('marker', marker), ('max-keys', max_keys)):
+            if value is not None:
+                options[name] = value
+
+        while True:
+            path = bucket
+            if options:
+                path += '?' + '&'.join(["%s=%s" % (param, urllib.quote_plus(str(options[param]))) for param in options])
+
+            response = ListBucketColumnsResponse(self.make_request('GET', path, headers), columns)
+            if response.http_response.status >= 300:
+                raise ListError(bucket, response)
+            if end is not None and columns.keys and columns.keys[-1] >= end:
+                columns.truncate(end)
+                return columns
+            if not response.is_truncated or len(columns) == response.start:
+                return columns
+            if parallelism:
+                break
+
+            options['marker'] = columns.keys[-1]
+
+        marker = columns.keys[-1]
+        if boundaries is None:
+            boundaries = self.plan_partitions(bucket, prefix, marker, headers=headers)
+
+        executor = RequestExecutor(parallelism)
+        try:
+            partitions = [executor.submit(self.list_bucket_columns, bucket, prefix, start, max_keys, stop, 
+                                          headers=headers)
+                          for start, stop in self.partition_ranges(marker, boundaries, end)]
+            for partition in partitions:
+                columns.extend(partition.result())
+        finally:
+            executor.shutdown(wait=False)
+
+        return columns
+
     def delete_bucket(self, bucket, headers={}):
-        return Response(self.make_request('DELETE', bucket, headers))
+        response = Response(self.make_request('DELETE', bucket, headers))
+        if response.http_response.status == 204:
+            self.remember_bucket(bucket, False)
+        return response
 
     def put(self, bucket, key, object, headers={}):
+        """ the object's data may be a string, a file, an mmap or another 
+            object with the buffer interface.  a file is sent from its 
+            position to its end without being read into a string. """
         if not isinstance(object, S3Object):
             object = S3Object(object)
 
-        return Response(
+        response = Response(
                 self.make_request(
                     'PUT',
                     '%s/%s' % (bucket, urllib.quote_plus(key)),
                     headers,
                     object.data,
                     object.metadata))
+        self.head_cache.pop((bucket, key))
+        return response
 
     def get(self, bucket, key, headers={}):
         return GetResponse(
                 self.make_request('GET', '%s/%s' % (bucket, urllib.quote_plus(key)), headers))
 
+    def head(self, bucket, key, headers={}):
+        """ an object's size, etag and metadata, without its body.  a 
+            successful response is kept in the head cache """
+        response = HeadResponse(
+                self.make_request('HEAD', '%s/%s' % (bucket, urllib.quote_plus(key)), headers))
+        if response.http_response.status == 200:
+            self.head_cache.put((bucket, key), (response, time.time()))
+        else:
+            self.head_cache.pop((bucket, key))
+        return response
+
+    def cached_head(self, bucket, key):
+        """ head, answered from the head cache when it can be.  the cache
+            forgets an object when it is put or deleted through this 
+            connection, and a change made by anything else is seen once the
+            cached response is head_cache_ttl seconds old. """
+        cached = self.head_cache.get((bucket, key))
+        if cached:
+            response, received = cached
+            if time.time() - received < self.head_cache_ttl:
+                return response
+        return self.head(bucket, key)
+
+    def get_stream(self, bucket, key, headers={}):
+        """ like get, but the body is left on the socket to be read as it's needed """
+        return StreamingGetResponse(
+                self.make_request('GET', '%s/%s' % (bucket, urllib.quote_plus(key)), headers))
+
     def delete(self, bucket, key, headers={}):
-        return Response(
+        response = Response(
                 self.make_request('DELETE', '%s/%s' % (bucket, urllib.quote_plus(key)), headers))
+        self.head_cache.pop((bucket, key))
+        return response
+
+    def delete_objects(self, bucket, keys, quiet=True, headers={}):
+        """ delete many keys with one multi-object delete request per
+            MAX_DELETE_KEYS of them.  returns a DeleteObjectsResponse for each
+            request, whose errors list the keys that could not be deleted.
+            when quiet is False the deleted keys are listed as well. """
+        responses = []
+        for start in range(0, len(keys), MAX_DELETE_KEYS):
+            xml_doc = '<Delete><Quiet>%s</Quiet>%s</Delete>' % (quiet and 'true' or 'false', ''.join(
+                ['<Object><Key>%s</Key></Object>' % escape(key) for key in keys[start:start + MAX_DELETE_KEYS]]))
+
+            final_headers = headers.copy()
+            final_headers['Content-MD5'] = base64.encodestring(hashlib.md5(xml_doc).digest()).strip()
+            responses.append(DeleteObjectsResponse(
+                    self.make_request('POST', '%s?delete' % bucket, final_headers, xml_doc)))
+            for key in keys[start:start + MAX_DELETE_KEYS]:
+                self.head_cache.pop((bucket, key))
+
+        return responses
+
+    def download_to(self, bucket, key, path_or_fileobj, parallelism=4,
+                    part_size=DEFAULT_DOWNLOAD_PART_SIZE, verify=True):
+        """ download an object into a local file, fetching part_size byte ranges
+            on parallelism connections at once.  each range is written straight
+            into place, through an mmap of the file when given a path.  every
+            range must come from the same version of the object and the size of
+            each range is checked.  a server that answers the first range with
+            the whole object is read from as one streamed GET instead.  the md5
+            of the copy is also checked against the etag of objects not 
+            uploaded in parts or encrypted with a KMS or customer key, which 
+            reads a file object back, so it must be open for reading as well 
+            unless verify is False.  returns the number of bytes downloaded. """
+
+        # the first range tells us the object's size and etag
+        response = self.get_stream(bucket, key, {'Range': 'bytes=0-%d' % (part_size - 1)})
+        status = response.http_response.status
+        if status == 416:
+            size, etag = 0, response.http_response.getheader('ETag')
+        elif status in (200, 206):
+            etag = response.http_response.getheader('ETag')
+            content_range = response.http_response.getheader('Content-Range')
+            content_length = response.http_response.getheader('Content-Length')
+            if content_range:
+                size = int(content_range.split('/')[-1])
+            elif content_length is not None:
+                size = int(content_length)
+            else:
+                raise DownloadError("GET %s/%s gave no size for the object" % (bucket, key), response)
+        else:
+            raise DownloadError("GET %s/%s failed with %d" % (bucket, key, status), response)
+
+        # the etag of an object encrypted with a KMS or customer key isn't an md5 of its data
+        if (response.http_response.getheader('x-amz-server-side-encryption') == 'aws:kms' or
+            response.http_response.getheader('x-amz-server-side-encryption-customer-algorithm')):
+            verify = False
+
+        # the bytes the first response carries, all of them if the server ignored the Range
+        first = size
+        if status == 206:
+            first = min(part_size, size)
+
+        is_path = isinstance(path_or_fileobj, basestring)
+        if is_path:
+            fileobj = open(path_or_fileobj, 'w+b')
+        else:
+            fileobj = path_or_fileobj
+
+        region = None
+        lock = threading.Lock()
+        try:
+            if is_path:
+                fileobj.truncate(size)
+                if size:
+                    region = mmap.mmap(fileobj.fileno(), size)
+
+            def write(offset, data):
+                if region is not None:
+                    region[offset:offset + len(data)] = data
+                else:
+                    with lock:
+                        fileobj.seek(offset)
+                        fileobj.write(data)
+
+            def copy(response, start, end):
+                offset = start
+                try:
+                    for chunk in response:
+                        write(offset, chunk)
+                        offset += len(chunk)
+                finally:
+                    response.close()
+
+                if offset != end + 1:
+                    raise DownloadError("expected bytes %d-%d of %s/%s but got %d bytes" %
+                                        (start, end, bucket, key, offset - start))
+
+            def fetch(start, end):
+                response = self.get_stream(bucket, key, {'Range': 'bytes=%d-%d' % (start, end), 'If-Match': etag})
+                if response.http_response.status != 206:
+                    raise DownloadError("GET %s/%s bytes %d-%d failed with %d" %
+                                        (bucket, key, start, end, response.http_response.status), response)
+                copy(response, start, end)
+
+            if size:
+                executor = RequestExecutor(parallelism)
+                futures = []
+                try:
+                    futures = [executor.submit(fetch, start, min(start + part_size, size) - 1)
+                               for start in range(first, size, part_size)]
+                    copy(response, 0, first - 1)
+                    for future in futures:
+                        future.result()
+                finally:
+                    # don't let a failed download close the file under the other ranges
+                    for future in futures:
+                        future.wait()
+                    executor.shutdown(wait=False)
+            else:
+                response.close()
+
+            # the etag of an object uploaded in parts isn't an md5 of its data
+            if verify and etag and '-' not in etag:
+                if region is not None:
+                    md5 = hashlib.md5(region)
+                else:
+                    md5 = hashlib.md5()
+                    fileobj.seek(0)
+                    for offset in range(0, size, part_size):
+                        md5.update(fileobj.read(min(part_size, size - offset)))
+                if md5.hexdigest() != etag.strip('"'):
+                    raise DownloadError("the md5 of %s/%s doesn't match its etag %s" % (bucket, key, etag))
+        finally:
+            if region is not None:
+                region.close()
+            if is_path:
+                fileobj.close()
+
+        return size
 
     def get_bucket_logging(self, bucket, headers={}):
         return GetResponse(self.make_request('GET', '%s?logging' % (bucket), headers))
@@ -163,22 +1550,203 @@ class AWSAuthConnection:
     def list_all_my_buckets(self, headers={}):
         return ListAllMyBucketsResponse(self.make_request('GET', '', headers))
 
+    def initiate_multipart_upload(self, bucket, key, headers={}, metadata={}):
+        return InitiateMultipartUploadResponse(
+                self.make_request(
+                    'POST',
+                    '%s/%s?uploads' % (bucket, urllib.quote_plus(key)),
+                    headers,
+                    '',
+                    metadata))
+
+    def upload_part(self, bucket, key, upload_id, part_number, data, headers={}):
+        return Response(
+                self.make_request(
+                    'PUT',
+                    '%s/%s?partNumber=%d&uploadId=%s' % (bucket, urllib.quote_plus(key), part_number, urllib.quote_plus(upload_id)),
+                    headers,
+                    data))
+
+    def complete_multipart_upload(self, bucket, key, upload_id, parts, headers={}):
+        """ parts is a list of (part_number, etag) pairs """
+        xml_doc = '<CompleteMultipartUpload>%s</CompleteMultipartUpload>' % ''.join(
+            ['<Part><PartNumber>%d</PartNumber><ETag>%s</ETag></Part>' % (part_number, etag)
+             for part_number, etag in sorted(parts)])
+
+        response = CompleteMultipartUploadResponse(
+                self.make_request(
+                    'POST',
+                    '%s/%s?uploadId=%s' % (bucket, urllib.quote_plus(key), urllib.quote_plus(upload_id)),
+                    headers,
+                    xml_doc))
+        self.head_cache.pop((bucket, key))
+        return response
+
+    def abort_multipart_upload(self, bucket, key, upload_id, headers={}):
+        return Response(
+                self.make_request(
+                    'DELETE',
+                    '%s/%s?uploadId=%s' % (bucket, urllib.quote_plus(key), urllib.quote_plus(upload_id)),
+                    headers))
+
     def make_request(self, method, path, headers={}, data='', metadata={}):
         final_headers = merge_meta(headers, metadata);
+        if not final_headers.has_key('Host'):
+            final_headers['Host'] = self.host
+        data = request_body(data)
+        # before the signer re-encodes the path, so the limiter sees the same key whichever signs
+        bucket, key = split_path(path)
         # add auth header
-        self.add_aws_auth_header(final_headers, method, path)
+        path, data = self.add_aws_auth_header(final_headers, method, path, data)
+        if not final_headers.has_key('Content-Length'):
+            final_headers['Content-Length'] = str(body_length(data))
+
+        attempt = 0
+        while True:
+            try:
+                response = self.send_limited_request(method, path, data, final_headers, bucket, key)
+            except STALE_CONNECTION_ERRORS:
+                if not self.retry_policy.allows_retry(method, None, attempt):
+                    raise
+            else:
+                if not self.retry_policy.allows_retry(method, response.status, attempt):
+                    if response.status < 500:
+                        self.retry_policy.record_success()
+                    response.retries = attempt
+                    return response
+                response.read() # hand the connection back before waiting
+
+            time.sleep(self.retry_policy.backoff(attempt))
+            attempt += 1
+
+    def send_limited_request(self, method, path, data, headers, bucket, key):
+        """ send_request, holding a place from the rate limiter while it runs.
+            the place is given back however the request ends. """
+        if not self.rate_limiter:
+            return self.send_request(method, path, data, headers)
+
+        self.rate_limiter.acquire(method, bucket, key)
+        status = None
+        try:
+            response = self.send_request(method, path, data, headers)
+            status = response.status
+            return response
+        finally:
+            self.rate_limiter.release(method, bucket, key, status)
+
+    def send_request(self, method, path, data, headers):
+        """ send one signed request on a pooled connection.  headers must 
+            include Host and Content-Length. """
+        while True:
+            connection = self.pool.checkout()
+            is_reused = connection.sock is not None
+            if hasattr(data, 'seek'):
+                data.seek(0) # a streamed body is sent again from the start
+            try:
+                connection.putrequest(method, "/%s" % path, skip_host=True,
+                                      skip_accept_encoding=headers.has_key('Accept-Encoding'))
+                for header, value in headers.iteritems():
+                    connection.putheader(header, value)
+                if isinstance(data, str) and len(data) <= DEFAULT_SEND_CHUNK_SIZE:
+                    connection.endheaders(data) # small bodies go in the same packet as the headers
+                else:
+                    connection.endheaders()
+                    send_body(connection, data)
+            except STALE_CONNECTION_ERRORS:
+                self.pool.discard(connection)
+                if is_reused:
+                    continue # the server dropped a kept-alive socket before it had the request, reconnect
+                raise
+            except:
+                self.pool.discard(connection)
+                raise
+
+            try:
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                self.pool.discard(connection)
+                # the server may have acted on the request before dropping the socket,
+                # so only an idempotent one is sent again here; make_request decides for the rest
+                if is_reused and method in self.retry_policy.idempotent_methods:
+                    continue
+                raise
+            except:
+                self.pool.discard(connection)
+                raise
+
+            # the connection goes back to the pool when the body has been read
+            response.pool = self.pool
+            response.pooled_connection = connection
+            return response
+
+
+    def add_aws_auth_header(self, headers, method, path, data=''):
+        """ sign a request, returning the path and body to send, which the 
+            signer may have rewritten """
+        return self.signer.sign_request(headers, method, path, data)
+
+
+class AsyncAWSAuthConnection:
+    """ the same operations as AWSAuthConnection, but each one returns at once
+        with a Future for its response instead of blocking the caller.  requests
+        run on the wrapped connection's pool and executor, so raise max_workers
+        to keep more of them in flight. """
+
+    def __init__(self, aws_access_key_id, aws_secret_access_key, is_secure=True,
+                 server=DEFAULT_HOST, port=None, **kwargs):
+        self.conn = AWSAuthConnection(aws_access_key_id, aws_secret_access_key,
+                                      is_secure, server, port, **kwargs)
 
-        self.connection.request(method, "/%s" % path, data, final_headers)
-        return self.connection.getresponse()
+    def close(self):
+        self.conn.close()
 
+    def create_bucket(self, bucket, headers={}):
+        return self.conn.submit('create_bucket', bucket, headers)
 
-    def add_aws_auth_header(self, headers, method, path):
-        if not headers.has_key('Date'):
-            headers['Date'] = time.strftime("%a, %d %b %Y %X GMT", time.gmtime())
+    def head_bucket(self, bucket, headers={}):
+        return self.conn.submit('head_bucket', bucket, headers)
 
-        c_string = canonical_string(method, path, headers)
-        headers['Authorization'] = \
-            "AWS %s:%s" % (self.aws_access_key_id, encode(self.aws_secret_access_key, c_string))
+    def list_bucket(self, bucket, options={}, headers={}):
+        return self.conn.submit('list_bucket', bucket, options, headers)
+
+    def delete_bucket(self, bucket, headers={}):
+        return self.conn.submit('delete_bucket', bucket, headers)
+
+    def put(self, bucket, key, object, headers={}):
+        return self.conn.submit('put', bucket, key, object, headers)
+
+    def get(self, bucket, key, headers={}):
+        return self.conn.submit('get', bucket, key, headers)
+
+    def head(self, bucket, key, headers={}):
+        return self.conn.submit('head', bucket, key, headers)
+
+    def delete(self, bucket, key, headers={}):
+        return self.conn.submit('delete', bucket, key, headers)
+
+    def delete_objects(self, bucket, keys, quiet=True, headers={}):
+        return self.conn.submit('delete_objects', bucket, keys, quiet, headers)
+
+    def get_bucket_logging(self, bucket, headers={}):
+        return self.conn.submit('get_bucket_logging', bucket, headers)
+
+    def put_bucket_logging(self, bucket, logging_xml_doc, headers={}):
+        return self.conn.submit('put_bucket_logging', bucket, logging_xml_doc, headers)
+
+    def get_bucket_acl(self, bucket, headers={}):
+        return self.conn.submit('get_bucket_acl', bucket, headers)
+
+    def get_acl(self, bucket, key, headers={}):
+        return self.conn.submit('get_acl', bucket, key, headers)
+
+    def put_bucket_acl(self, bucket, acl_xml_document, headers={}):
+        return self.conn.submit('put_bucket_acl', bucket, acl_xml_document, headers)
+
+    def put_acl(self, bucket, key, acl_xml_document, headers={}):
+        return self.conn.submit('put_acl', bucket, key, acl_xml_document, headers)
+
+    def list_all_my_buckets(self, headers={}):
+        return self.conn.submit('list_all_my_buckets', headers)
 
 
 class QueryStringAuthGenerator:
@@ -186,19 +1754,23 @@ class QueryStringAuthGenerator:
     DEFAULT_EXPIRES_IN = 60
 
     def __init__(self, aws_access_key_id, aws_secret_access_key, is_secure=True,
-                 server=DEFAULT_HOST, port=None):
+                 server=DEFAULT_HOST, port=None, signer=None):
 
         if not port:
             port = PORTS_BY_SECURITY[is_secure]
 
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
+        self.signer = signer or Signer(aws_access_key_id, aws_secret_access_key)
         if (is_secure):
             self.protocol = 'https'
         else:
             self.protocol = 'http'
 
         self.server_name = "%s:%d" % (server, port)
+        self.host = server
+        if port != PORTS_BY_SECURITY[is_secure]:
+            self.host = self.server_name
         self.__expires_in = QueryStringAuthGenerator.DEFAULT_EXPIRES_IN
         self.__expires = None
 
@@ -263,26 +1835,56 @@ class QueryStringAuthGenerator:
     def make_bare_url(self, bucket, key=''):
         return self.protocol + '://' + self.server_name + '/' + bucket + '/' + key
 
-    def generate_url(self, method, path, headers):
-        expires = 0
+    def get_many(self, bucket, keys, expires=None, headers={}, processes=None, batch_size=DEFAULT_PRESIGN_BATCH):
+        """ urls for GETs of many keys in a bucket, in the same order.  they
+            all expire at expires, or at the time set_expires_in or 
+            set_expires would give a single url.  the signing work that 
+            doesn't depend on the key is only done once.  for very large 
+            batches, processes fans the keys out to a pool of that many 
+            worker processes, batch_size at a time. """
+        if expires is None:
+            expires = self.get_expires()
+        if not headers.has_key('Host'):
+            headers = dict(headers, Host=self.host)
+
+        if processes:
+            keys = list(keys)
+            batches = [(self.signer, 'GET', bucket, keys[i:i + batch_size], headers, expires)
+                       for i in range(0, len(keys), batch_size)]
+            pool = multiprocessing.Pool(processes)
+            try:
+                paths = []
+                for batch in pool.imap(presign_batch, batches):
+                    paths.extend(batch)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            paths = self.signer.presign_keys('GET', bucket, keys, headers, expires)
+
+        base = self.protocol + '://' + self.server_name + '/'
+        return [base + path for path in paths]
+
+    def get_expires(self):
+        """ the expiry time of a url generated now """
         if self.__expires_in != None:
-            expires = int(time.time() + self.__expires_in)
+            return int(time.time() + self.__expires_in)
         elif self.__expires != None:
-            expires = int(self.__expires)
+            return int(self.__expires)
         else:
             raise "Invalid expires state"
 
-        canonical_str = canonical_string(method, path, headers, expires)
-        encoded_canonical = encode(self.aws_secret_access_key, canonical_str, True)
+    def generate_url(self, method, path, headers):
+        expires = self.get_expires()
 
-        if '?' in path:
-            arg_div = '&'
-        else:
-            arg_div = '?'
+        if not headers.has_key('Host'):
+            headers = dict(headers, Host=self.host)
 
-        query_part = "Signature=%s&Expires=%d&AWSAccessKeyId=%s" % (encoded_canonical, expires, self.aws_access_key_id)
+        return self.protocol + '://' + self.server_name + '/' + self.signer.presign(method, path, headers, expires)
 
-        return self.protocol + '://' + self.server_name + '/' + path  + arg_div + query_part
+def presign_batch((signer, method, bucket, keys, headers, expires)):
+    """ QueryStringAuthGenerator.get_many's work in a worker process """
+    return signer.presign_keys(method, bucket, keys, headers, expires)
 
 
 
@@ -305,8 +1907,85 @@ class ListEntry:
         self.storage_class = storage_class
         self.owner = owner
 
+class CompactListEntry(object):
+    """ a ListEntry without a per-instance __dict__, for large listings.
+        the owner is only built into an Owner when it's asked for.  unlike a
+        ListEntry, it can't be given attributes of its own """
+    __slots__ = ('key', 'last_modified', 'etag', 'size', 'storage_class', 'owner_id', 'owner_display_name')
+
+    def __init__(self, key='', last_modified=None, etag='', size=0, storage_class='',
+                 owner_id=None, owner_display_name=''):
+        self.key = key
+        self.last_modified = last_modified
+        self.etag = etag
+        self.size = size
+        self.storage_class = storage_class
+        self.owner_id = owner_id
+        self.owner_display_name = owner_display_name
+
+    def get_owner(self):
+        if self.owner_id is None:
+            return None
+        return Owner(self.owner_id, self.owner_display_name)
+
+    def set_owner(self, owner):
+        if owner is None:
+            self.owner_id, self.owner_display_name = None, ''
+        else:
+            self.owner_id, self.owner_display_name = owner.id, owner.display_name
+
+    owner = property(get_owner, set_owner)
+
+    # classes with __slots__ can't be pickled at protocol 0 or 1 without these
+    def __getstate__(self):
+        return tuple([getattr(self, name) for name in self.__slots__])
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+class ListColumns:
+    """ a listing held as columns: a list of keys, and arrays of sizes and of
+        last modified times in epoch seconds, all in key order """
+
+    def __init__(self):
+        self.keys = []
+        self.sizes = array(INT64_TYPECODE)
+        self.last_modified = array(INT64_TYPECODE)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def extend(self, other):
+        self.keys.extend(other.keys)
+        self.sizes.extend(other.sizes)
+        self.last_modified.extend(other.last_modified)
+
+    def truncate(self, end):
+        """ drop the keys that sort after end """
+        count = bisect.bisect_right(self.keys, end)
+        del self.keys[count:]
+        del self.sizes[count:]
+        del self.last_modified[count:]
+
+    def total_size(self):
+        return sum(self.sizes)
+
+# 2010-01-01T12:00:00.000Z to epoch seconds.  listings share a few distinct
+# days, so the midnight of each day is only worked out once.
+DAY_STARTS = {}
+
+def parse_timestamp(timestamp):
+    day = timestamp[:10]
+    day_start = DAY_STARTS.get(day)
+    if day_start is None:
+        if len(DAY_STARTS) > 10000:
+            DAY_STARTS.clear()
+        day_start = DAY_STARTS[day] = calendar.timegm((int(day[:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0))
+    return day_start + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
 class CommonPrefixEntry:
-    def __init(self, prefix=''):
+    def __init__(self, prefix=''):
         self.prefix = prefix
 
 class Bucket:
@@ -320,13 +1999,19 @@ class Response:
         # you have to do this read, even if you don't expect a body.
         # otherwise, the next request fails.
         self.body = http_response.read()
+        # how many times make_request retried to get this response
+        self.retries = getattr(http_response, 'retries', 0)
 
 class ListBucketResponse(Response):
-    def __init__(self, http_response):
+    def __init__(self, http_response, fast=True):
         Response.__init__(self, http_response)
         if http_response.status < 300:
-            handler = ListBucketHandler()
-            xml.sax.parseString(self.body, handler)
+            if fast:
+                handler = FastListBucketParser()
+                handler.parse(self.body)
+            else:
+                handler = ListBucketHandler()
+                xml.sax.parseString(self.body, handler)
             self.entries = handler.entries
             self.common_prefixes = handler.common_prefixes
             self.name = handler.name
@@ -339,6 +2024,21 @@ class ListBucketResponse(Response):
         else:
             self.entries = []
 
+class ListBucketColumnsResponse(Response):
+    """ appends the keys of one page of a listing to columns, a ListColumns.
+        start is the number of keys columns held before this page """
+    def __init__(self, http_response, columns):
+        Response.__init__(self, http_response)
+        self.columns = columns
+        self.start = len(columns)
+        self.is_truncated = False
+        self.next_marker = ''
+        if http_response.status < 300:
+            parser = ColumnListBucketParser(columns)
+            parser.parse(self.body)
+            self.is_truncated = parser.is_truncated
+            self.next_marker = parser.next_marker
+
 class ListAllMyBucketsResponse(Response):
     def __init__(self, http_response):
         Response.__init__(self, http_response)
@@ -365,6 +2065,142 @@ class GetResponse(Response):
 
         return metadata
 
+class HeadResponse(GetResponse):
+    """ the headers of an object, parsed.  last_modified is in epoch seconds """
+    def __init__(self, http_response):
+        GetResponse.__init__(self, http_response)
+        self.metadata = self.object.metadata
+        self.size = int(http_response.getheader('Content-Length') or 0)
+        self.etag = http_response.getheader('ETag', '')
+        self.content_type = http_response.getheader('Content-Type', '')
+        self.last_modified = None
+        if http_response.getheader('Last-Modified'):
+            self.last_modified = calendar.timegm(rfc822.parsedate(http_response.getheader('Last-Modified')))
+
+class StreamingGetResponse(GetResponse):
+    """ a GetResponse that doesn't read the body up front.  read it with read(),
+        by iterating over its chunks or with copy_to(), then close the response.
+        error bodies are small, so they are read right away into self.body. """
+    def __init__(self, http_response, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.http_response = http_response
+        self.chunk_size = chunk_size
+        self.retries = getattr(http_response, 'retries', 0)
+        self.body = None
+        if http_response.status >= 300:
+            self.body = http_response.read()
+        self.metadata = self.get_aws_metadata(http_response.msg)
+
+    def read(self, amt=None):
+        return self.http_response.read(amt)
+
+    def __iter__(self):
+        while True:
+            chunk = self.http_response.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def copy_to(self, fileobj):
+        """ write the rest of the body to fileobj, returning the number of bytes written """
+        length = 0
+        for chunk in self:
+            fileobj.write(chunk)
+            length += len(chunk)
+        return length
+
+    def close(self):
+        """ release the connection.  if the body hasn't been read to the end
+            the connection can't be reused, so it's dropped """
+        if self.http_response.isclosed():
+            return
+        if hasattr(self.http_response, 'abandon'):
+            self.http_response.abandon()
+        else:
+            self.http_response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class InitiateMultipartUploadResponse(Response):
+    def __init__(self, http_response):
+        Response.__init__(self, http_response)
+        self.upload_id = ''
+        if http_response.status < 300:
+            handler = ElementTextHandler()
+            xml.sax.parseString(self.body, handler)
+            self.upload_id = handler.text.get('UploadId', '')
+
+class CompleteMultipartUploadResponse(Response):
+    """ S3 can report a failed completion in the body of a 200 response, in
+        which case error_code is set """
+    def __init__(self, http_response):
+        Response.__init__(self, http_response)
+        self.etag = ''
+        self.error_code = ''
+        if http_response.status < 300:
+            handler = ElementTextHandler()
+            xml.sax.parseString(self.body, handler)
+            self.etag = handler.text.get('ETag', '')
+            if handler.root == 'Error':
+                self.error_code = handler.text.get('Code', 'InternalError')
+
+class DeleteObjectsResponse(Response):
+    """ deleted lists the keys a multi-object delete removed, unless it was
+        quiet, and errors the (key, code, message) of each it could not """
+    def __init__(self, http_response):
+        Response.__init__(self, http_response)
+        self.deleted = []
+        self.errors = []
+        if http_response.status < 300:
+            handler = DeleteResultHandler()
+            xml.sax.parseString(self.body, handler)
+            self.deleted = handler.deleted
+            self.errors = handler.errors
+
+class DeleteResultHandler(xml.sax.ContentHandler):
+    def __init__(self):
+        self.deleted = []
+        self.errors = []
+        self.text = {}
+        self.curr_text = ''
+
+    def startElement(self, name, attrs):
+        if name in ('Deleted', 'Error'):
+            self.text = {}
+        self.curr_text = ''
+
+    def endElement(self, name):
+        if name == 'Deleted':
+            self.deleted.append(self.text.get('Key', ''))
+        elif name == 'Error':
+            self.errors.append((self.text.get('Key', ''), self.text.get('Code', ''), self.text.get('Message', '')))
+        else:
+            self.text[name] = self.curr_text
+
+    def characters(self, content):
+        self.curr_text += content
+
+class ElementTextHandler(xml.sax.ContentHandler):
+    """ collects the text of each element by name, for small flat documents """
+    def __init__(self):
+        self.root = None
+        self.text = {}
+        self.curr_text = ''
+
+    def startElement(self, name, attrs):
+        if self.root is None:
+            self.root = name
+        self.curr_text = ''
+
+    def endElement(self, name):
+        self.text[name] = self.curr_text
+
+    def characters(self, content):
+        self.curr_text += content
+
 class ListBucketHandler(xml.sax.ContentHandler):
     def __init__(self):
         self.entries = []
@@ -433,6 +2269,152 @@ class ListBucketHandler(xml.sax.ContentHandler):
         self.curr_text += content
 
 
+class FastListBucketParser:
+    """ builds the same result as ListBucketHandler, but drives expat directly
+        and looks up what to do at the end of each element in a table, making
+        CompactListEntry objects instead of ListEntry and Owner objects """
+
+    def __init__(self):
+        self.entries = []
+        self.curr_entry = None
+        self.text = []
+        self.common_prefixes = []
+        self.in_common_prefix = False
+        self.name = ''
+        self.marker = ''
+        self.prefix = ''
+        self.is_truncated = False
+        self.delimiter = ''
+        self.max_keys = 0
+        self.next_marker = ''
+
+    def parse(self, body):
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.text.append
+        parser.Parse(body, True)
+
+    def start_element(self, name, attrs):
+        if name == 'Contents':
+            self.curr_entry = CompactListEntry()
+        elif name == 'CommonPrefixes':
+            self.in_common_prefix = True
+        del self.text[:]
+
+    def end_element(self, name):
+        handler = self.END_HANDLERS.get(name)
+        if handler:
+            handler(self, ''.join(self.text))
+        del self.text[:]
+
+    def end_contents(self, text):
+        self.entries.append(self.curr_entry)
+
+    def end_key(self, text):
+        self.curr_entry.key = text
+
+    def end_last_modified(self, text):
+        self.curr_entry.last_modified = text
+
+    def end_etag(self, text):
+        self.curr_entry.etag = text
+
+    def end_size(self, text):
+        self.curr_entry.size = int(text)
+
+    def end_id(self, text):
+        self.curr_entry.owner_id = text
+
+    def end_display_name(self, text):
+        self.curr_entry.owner_display_name = text
+
+    def end_storage_class(self, text):
+        self.curr_entry.storage_class = text
+
+    def end_common_prefixes(self, text):
+        self.in_common_prefix = False
+
+    def end_prefix(self, text):
+        if self.in_common_prefix:
+            self.common_prefixes.append(CommonPrefixEntry(text))
+        else:
+            self.prefix = text
+
+    def end_name(self, text):
+        self.name = text
+
+    def end_marker(self, text):
+        self.marker = text
+
+    def end_is_truncated(self, text):
+        self.is_truncated = text == 'true'
+
+    def end_delimiter(self, text):
+        self.delimiter = text
+
+    def end_max_keys(self, text):
+        self.max_keys = int(text)
+
+    def end_next_marker(self, text):
+        self.next_marker = text
+
+    END_HANDLERS = {
+        'Contents': end_contents,
+        'Key': end_key,
+        'LastModified': end_last_modified,
+        'ETag': end_etag,
+        'Size': end_size,
+        'ID': end_id,
+        'DisplayName': end_display_name,
+        'StorageClass': end_storage_class,
+        'CommonPrefixes': end_common_prefixes,
+        'Prefix': end_prefix,
+        'Name': end_name,
+        'Marker': end_marker,
+        'IsTruncated': end_is_truncated,
+        'Delimiter': end_delimiter,
+        'MaxKeys': end_max_keys,
+        'NextMarker': end_next_marker,
+    }
+
+class ColumnListBucketParser(FastListBucketParser):
+    """ a FastListBucketParser that appends each key to a ListColumns """
+
+    def __init__(self, columns):
+        FastListBucketParser.__init__(self)
+        self.columns = columns
+        self.key = ''
+        self.size = 0
+        self.last_modified = 0
+
+    def start_element(self, name, attrs):
+        del self.text[:]
+
+    def end_contents(self, text):
+        self.columns.keys.append(self.key)
+        self.columns.sizes.append(self.size)
+        self.columns.last_modified.append(self.last_modified)
+
+    def end_key(self, text):
+        self.key = text
+
+    def end_size(self, text):
+        self.size = int(text)
+
+    def end_last_modified(self, text):
+        self.last_modified = parse_timestamp(text)
+
+    END_HANDLERS = {
+        'Contents': end_contents,
+        'Key': end_key,
+        'LastModified': end_last_modified,
+        'Size': end_size,
+        'IsTruncated': FastListBucketParser.END_HANDLERS['IsTruncated'],
+        'NextMarker': FastListBucketParser.END_HANDLERS['NextMarker'],
+    }
+
 class ListAllMyBucketsHandler(xml.sax.ContentHandler):
     def __init__(self):
         self.entries = []
@@ -1,10 +1,13 @@
 from StringIO import StringIO
 import exceptions
+import itertools
 from lib import S3
 from S3Errors import *
+from S3Props import props_cache
 
 __all__ = [
        "check_http_response",
+       "delete_keys",
        "force_delete_bucket"
 ]
 
@@ -19,16 +22,34 @@ def check_http_response(response, http_code=None):
     if response.http_response.status > 300:
         raise S3ResponseError, response
 
-def force_delete_bucket(conn, bucket_name):
-    r = conn.list_bucket(bucket_name)
-    check_http_response(r)
+def delete_keys(conn, bucket_name, keys):
+    """ delete keys, which may be any iterable, with multi-object deletes of 
+        up to S3.MAX_DELETE_KEYS keys each.  raises S3DeleteError naming the
+        keys that could not be deleted. """
+    keys = iter(keys)
+    errors = []
+    while True:
+        batch = list(itertools.islice(keys, S3.MAX_DELETE_KEYS))
+        if not batch:
+            break
+        
+        for r in conn.delete_objects(bucket_name, batch):
+            check_http_response(r)
+            errors.extend(r.errors)
     
-    for entry in r.entries:
-        r = conn.delete(bucket_name, entry.key)
-        check_http_response(r)
+    if errors:
+        raise S3DeleteError, errors
+
+def force_delete_bucket(conn, bucket_name, parallelism=S3.DEFAULT_LIST_PARALLELISM):
+    try:
+        delete_keys(conn, bucket_name, 
+                    (entry.key for entry in conn.iter_bucket_parallel(bucket_name, parallelism=parallelism)))
+    except S3.ListError, e:
+        raise S3ResponseError, e.response
     
     r = conn.delete_bucket(bucket_name)
     check_http_response(r)
+    props_cache.invalidate(conn.host, bucket_name)
     
     return r
      